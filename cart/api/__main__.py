@@ -1,6 +1,8 @@
 import logging
 
+import uvloop
 from aiohttp import web
+from aiohttp.log import access_logger
 from aiomisc.log import basic_config
 
 from cart import settings
@@ -8,9 +10,12 @@ from cart.api.app import create_app
 
 
 def main():
+    # Faster uvloop event loop is set up before web.run_app creates the loop
+    uvloop.install()
     app = create_app()
     basic_config(logging.DEBUG, buffered=True)
-    web.run_app(app, port=settings.SERVICE_PORT)
+    # Access log is written synchronously for each request, so it's written only in debug mode
+    web.run_app(app, port=settings.SERVICE_PORT, access_log=access_logger if settings.DEBUG else None)
 
 
 if __name__ == '__main__':
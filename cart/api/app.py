@@ -1,18 +1,20 @@
 import logging
-from functools import partial
+from functools import cache, partial
 from types import AsyncGeneratorType, MappingProxyType
 from typing import AsyncIterable, Mapping
 
+import grpc
 from aiohttp import PAYLOAD_REGISTRY
 from aiohttp.web_app import Application
 from aiohttp_apispec import validation_middleware, AiohttpApiSpec
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine
 
 from cart import settings
 from cart.api import API_VIEWS
-from cart.api.middleware import error_middleware, grpc_jwt_middleware
-from cart.api.payloads import AsyncGenJSONListPayload, JsonPayload
+from cart.api.middleware import grpc_jwt_error_middleware, request_validation_error_callback
+from cart.api.payloads import AsyncGenJSONListPayload, JsonPayload, PreserializedAsyncGenJSONListPayload
+from cart.db.engine import create_engine
+from cart.utils import JSONSelectQuery
+from protobufs.auth_pb2_grpc import UserAuthStub
 
 
 log = logging.getLogger(__name__)
@@ -23,9 +25,10 @@ async def setup_db(app: Application, pg_url: str | None = None):
     Initiate connection to database on startup and close it on cleanup
     """
     log.info(f'Connecting to database: {settings.DB_INFO}')
-    engine = create_async_engine(pg_url or settings.DB_URL, echo=settings.DEBUG)
-    async with engine.connect() as conn:
-        await conn.execute(text('Select 1;'))
+    engine = create_engine(pg_url)
+    # Connection is opened to fail on startup if database is unavailable, it's kept in the pool for requests
+    async with engine.connect():
+        pass
     app['engine'] = engine
     log.info(f'Connected to database: {settings.DB_INFO}')
 
@@ -38,15 +41,57 @@ async def setup_db(app: Application, pg_url: str | None = None):
         log.info(f'Disconnected from database: {settings.DB_INFO}')
 
 
+async def setup_grpc_client(app: Application):
+    """
+    Open secure gRPC channel to customers service on startup and close it on cleanup
+    """
+    # TLS certificates are read once on startup, so a missing file stops the service before serving requests
+    try:
+        with open('client.key', 'rb') as file:
+            client_key = file.read()
+        with open('client.pem', 'rb') as file:
+            client_cert = file.read()
+        with open('ca.pem', 'rb') as file:
+            ca_cert = file.read()
+    except OSError as err:
+        log.critical(f'Unable to read TLS certificates for gRPC channel: {err}')
+        raise
+    creds = grpc.ssl_channel_credentials(ca_cert, client_key, client_cert)
+    channel = grpc.aio.secure_channel(f'{settings.CUSTOMERS_HOST}:{settings.GRPC_PORT}', creds)
+    app['grpc_client'] = UserAuthStub(channel)
+    log.info('Opened gRPC channel.')
+
+    try:
+        yield
+
+    finally:
+        await channel.close()
+        log.info('Closed gRPC channel.')
+
+
+@cache
+def register_payloads():
+    """
+    Registers payloads in the global aiohttp registry only once,
+    otherwise each created application would make payloads lookups longer.
+    """
+    PAYLOAD_REGISTRY.register(PreserializedAsyncGenJSONListPayload, JSONSelectQuery)
+    PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload, (AsyncGeneratorType, AsyncIterable))
+    PAYLOAD_REGISTRY.register(JsonPayload, (Mapping, MappingProxyType))
+
+
 def create_app(pg_url: str | None = None) -> Application:
     """
     Creates an instance of the application, ready to run.
     """
-    app = Application(middlewares=[error_middleware, grpc_jwt_middleware, validation_middleware])
+    app = Application(middlewares=[grpc_jwt_error_middleware, validation_middleware])
 
     # Connect to postgres at start and disconnect at stop
     app.cleanup_ctx.append(partial(setup_db, pg_url=pg_url))
 
+    # Open gRPC channel to customers service at start and close it at stop
+    app.cleanup_ctx.append(setup_grpc_client)
+
     # Registering views
     for view in API_VIEWS:
         log.debug(f'Registering view {view} as {view.URL_PATH}')
@@ -55,13 +100,13 @@ def create_app(pg_url: str | None = None) -> Application:
     # Swagger documentation
     api_spec = AiohttpApiSpec(app=app, title='Cart Service API', version='v1', request_data_name='validated_data',
                               swagger_path=settings.DOCS_PATH, url=f'{settings.DOCS_PATH}swagger.json',
-                              static_path=f'{settings.DOCS_PATH}static')
+                              static_path=f'{settings.DOCS_PATH}static',
+                              error_callback=request_validation_error_callback)
     # Manual add Authorize header to swagger
     api_key_scheme = {"type": "apiKey", "in": "header", "name": "Authorization"}
     api_spec.spec.components.security_scheme('JWT Authorization', api_key_scheme)
 
     # Automatic json serialization of data in HTTP responses
-    PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload, (AsyncGeneratorType, AsyncIterable))
-    PAYLOAD_REGISTRY.register(JsonPayload, (Mapping, MappingProxyType))
+    register_payloads()
 
     return app
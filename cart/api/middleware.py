@@ -1,8 +1,9 @@
-import json
+import hashlib
 import logging
 import re
+import time
 from http import HTTPStatus
-from typing import Mapping
+from typing import Mapping, NoReturn
 
 import grpc
 from aiohttp import web
@@ -17,10 +18,16 @@ from cart.api import JWT_WHITE_LIST
 from cart.api.payloads import JsonPayload
 from cart.utils import fix_white_list_urls
 from protobufs.auth_pb2 import AuthRequest, JwtToken
-from protobufs.auth_pb2_grpc import UserAuthStub
 
 log = logging.getLogger(__name__)
 VALIDATION_ERROR_DESCRIPTION = 'Request validation has failed'
+# All whitelisted url patterns are joined into a single regexp, compiled once
+WHITELIST_RE = re.compile('|'.join(f'(?:{pattern})'
+                                   for pattern in [f'{settings.DOCS_PATH}.*', *fix_white_list_urls(JWT_WHITE_LIST)]))
+# Whitelisted paths without variable parts are found by set lookup, without regexp matching
+WHITELIST_PATHS = frozenset(path for path in JWT_WHITE_LIST if '{' not in path)
+# Validated tokens payloads: {token hash: (expiration monotonic time, payload)}
+TOKEN_CACHE: dict[bytes, tuple[float, dict]] = {}
 
 
 def format_http_error(message: str | None = '', status_code: int = HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -29,34 +36,112 @@ def format_http_error(message: str | None = '', status_code: int = HTTPStatus.IN
     Formats the error as an HTTP exception
     """
     status = HTTPStatus(status_code)
-    error = {'code': status.name.lower()}
+    error = {'code': status.name.lower(), 'message': message or status.description}
 
     # Adds field errors which failed marshmallow validation
-    if '{' in message:
-        error['message'] = VALIDATION_ERROR_DESCRIPTION
-        error['fields'] = json.loads(message)
-    # Other errors
-    else:
-        error['message'] = message or status.description
-
-    # Adds field errors which failed validation in views
     if fields:
         error['fields'] = fields
 
     return Response(body={'error': error}, status=status_code)
 
 
+class RequestValidationError(ValidationError):
+    """
+    Request data validation error, which is raised instead of aiohttp-apispec's HTTP error with json text.
+    """
+
+
+def request_validation_error_callback(error: ValidationError, *args, **kwargs) -> NoReturn:
+    """
+    Passes field errors of the request validation to the error middleware as is, not as json text.
+    """
+    raise RequestValidationError(error.messages)
+
+
 def handle_validation_error(error: ValidationError):
     """
     Represents a data validation error as an HTTP response.
     """
-    return format_http_error(message=VALIDATION_ERROR_DESCRIPTION, status_code=HTTPStatus.BAD_REQUEST,
-                             fields=error.messages)
+    status_code = HTTPStatus.UNPROCESSABLE_ENTITY if isinstance(error, RequestValidationError) \
+        else HTTPStatus.BAD_REQUEST
+    return format_http_error(message=VALIDATION_ERROR_DESCRIPTION, status_code=status_code, fields=error.messages)
+
+
+def check_request_in_whitelist(request: Request, whitelist_re: re.Pattern = WHITELIST_RE,
+                               whitelist_paths: frozenset[str] = WHITELIST_PATHS) -> bool:
+    """
+    Checks if the requested view is from a whitelist.
+    """
+    return request.path in whitelist_paths or whitelist_re.match(request.path) is not None
+
+
+def get_token_cache_key(jwt_token: str) -> bytes:
+    """
+    Hashes the token, so raw tokens are not kept in memory.
+    """
+    return hashlib.blake2b(jwt_token.encode(), digest_size=16).digest()
+
+
+def get_cached_token_payload(token_key: bytes) -> dict | None:
+    """
+    Returns cached payload of the validated token if it's not expired yet.
+    """
+    if (cached := TOKEN_CACHE.get(token_key)) is not None:
+        expires_at, payload = cached
+        if expires_at > time.monotonic():
+            return payload
+        del TOKEN_CACHE[token_key]
+    return None
+
+
+def cache_token_payload(token_key: bytes, payload: dict) -> None:
+    """
+    Stores the validated token payload, but not longer than the token itself is valid.
+    Drops the oldest 10% of entries if the cache is full.
+    """
+    if len(TOKEN_CACHE) >= settings.JWT_CACHE_MAX_SIZE:
+        for key in list(TOKEN_CACHE)[:settings.JWT_CACHE_MAX_SIZE // 10 or 1]:
+            del TOKEN_CACHE[key]
+    ttl = min(settings.JWT_CACHE_TTL, payload['exp'] - time.time()) if 'exp' in payload else settings.JWT_CACHE_TTL
+    TOKEN_CACHE[token_key] = (time.monotonic() + ttl, payload)
+
+
+async def validate_jwt_token(request: Request) -> None:
+    """
+    Validates user's jwt token via gRPC request and sets its payload to request.
+    """
+    # Raise error if request doesn't have `Authorization` header
+    if not (jwt_token := request.headers.get('Authorization')):
+        raise web.HTTPForbidden(reason='Invalid authorization header')
+    # Skip gRPC request if the token was validated recently
+    token_key = get_token_cache_key(jwt_token)
+    if (payload := get_cached_token_payload(token_key)) is not None:
+        request['payload'] = payload
+        return
+    # Get gRPC response using the shared secure channel (see `setup_grpc_client`)
+    grpc_client = request.app['grpc_client']
+    grpc_request = AuthRequest(token=JwtToken(value=jwt_token))
+    try:
+        grpc_response = await grpc_client.ValidateToken(grpc_request)
+    except grpc.aio.AioRpcError as err:
+        raise web.HTTPForbidden(reason=err.details())  # noqa
+    # Set data from gRPC response to request and cache it
+    payload = {'user_id': grpc_response.payload.user_id, 'is_admin': grpc_response.payload.is_admin,
+               'exp': grpc_response.payload.exp}
+    cache_token_payload(token_key, payload)
+    request['payload'] = payload
 
 
 @middleware
-async def error_middleware(request: Request, handler):
+async def grpc_jwt_error_middleware(request: Request, handler):
+    """
+    Middleware to validate user's jwt token via gRPC request and to format errors as HTTP responses.
+    Both steps live in one middleware so each request passes through a single layer of the handler chain.
+    """
     try:
+        # Skip token validation if requested view in whitelist
+        if not check_request_in_whitelist(request):
+            await validate_jwt_token(request)
         return await handler(request)
     except HTTPException as err:
         # Exceptions that are HTTP responses were deliberately thrown for display to the client.
@@ -66,7 +151,7 @@ async def error_middleware(request: Request, handler):
         raise  # pragma: no cover
 
     except ValidationError as err:
-        # Checking for errors in views
+        # Checking for errors in request data and views
         return handle_validation_error(err)
 
     except Exception:  # pragma: no cover
@@ -74,44 +159,3 @@ async def error_middleware(request: Request, handler):
         # and may inadvertently reveal internal information.
         log.exception('Unhandled exception')
         return format_http_error()
-
-
-def check_request_in_whitelist(request: Request, whitelist_urls: list[str]) -> bool:
-    """
-    Checks if the requested view is from a whitelist.
-    """
-    for pattern in whitelist_urls:
-        if re.match(pattern, request.path):
-            return True
-    return False
-
-
-@middleware
-async def grpc_jwt_middleware(request: Request, handler):
-    """
-    Middleware to validate user's jwt token via gRPC request.
-    """
-    # Skip middleware if requested view in whitelist
-    whitelist = [f'{settings.DOCS_PATH}.*'] + fix_white_list_urls(JWT_WHITE_LIST)
-    if check_request_in_whitelist(request, whitelist):
-        return await handler(request)
-    # Raise error if request doesn't have `Authorization` header
-    if not (jwt_token := request.headers.get('Authorization')):
-        raise web.HTTPForbidden(reason='Invalid authorization header')
-    # Create gRPC objects and get gRPC response using secure channel
-    with open('client.key', 'rb') as file:
-        client_key = file.read()
-    with open('client.pem', 'rb') as file:
-        client_cert = file.read()
-    with open('ca.pem', 'rb') as file:
-        ca_cert = file.read()
-    creds = grpc.ssl_channel_credentials(ca_cert, client_key, client_cert)
-    grpc_client = UserAuthStub(grpc.secure_channel(f'{settings.CUSTOMERS_HOST}:{settings.GRPC_PORT}', creds))
-    grpc_request = AuthRequest(token=JwtToken(value=jwt_token))
-    try:
-        grpc_response = grpc_client.ValidateToken(grpc_request)
-    except grpc.RpcError as err:
-        raise web.HTTPForbidden(reason=err.details())  # noqa
-    # Set data from gRPC response to request
-    request['payload'] = {'user_id': grpc_response.payload.user_id, 'is_admin': grpc_response.payload.is_admin}
-    return await handler(request)
@@ -1,37 +1,68 @@
 from decimal import Decimal
+from functools import cached_property
 from typing import NoReturn
 
 from aiohttp.web_exceptions import HTTPNotFound, HTTPForbidden
 from aiohttp.web_response import StreamResponse
 
-from sqlalchemy import exists, select, Column, func
+from sqlalchemy import bindparam, exists, func, select, Column
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.sql import Select
 
 from cart.db.models import cartitems_t, products_t
 
 
-class CheckObjectExistsMixin:
-    object_id_path: str
-    check_exists_column: Column
+EMPTY_CART_TOTAL_PRICE = Decimal('0.00')
+# Cart items and the cart total price are fetched in one round-trip, the total is summed up by PostgreSQL
+CART_ITEMS_QUERY = (select(cartitems_t,
+                           func.round(func.sum(cartitems_t.c.quantity * products_t.c.price).over(), 2)
+                           .label('total_price'))
+                    .join(products_t)
+                    .where(cartitems_t.c.cart_id == bindparam('cart_id')))
 
-    async def _iter(self) -> StreamResponse:
-        await self.check_object_exists()
-        return await super()._iter()
 
-    @property
+class ObjectIdMixin:
+    object_id_path: str
+
+    @cached_property
     def object_id(self) -> int:
-        return int(self.request.match_info.get(self.object_id_path))
+        return int(self.request.match_info[self.object_id_path])
+
+
+class CheckObjectExistsMixin(ObjectIdMixin):
+    """
+    Object existence is not checked in advance: views get it from their own queries.
+    It's checked only before access denial, so requests to not existent objects get 404 response.
+    """
+    check_exists_column: Column
+    check_exists_query: Select
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The query is built once per view class, only object id is passed on each request
+        if (column := getattr(cls, 'check_exists_column', None)) is not None:
+            cls.check_exists_query = select(exists().where(column == bindparam('object_id')))
 
     async def check_object_exists(self) -> NoReturn:
-        query = select(exists().where(self.check_exists_column == self.object_id))
         async with self.engine.connect() as conn:
-            result = await conn.execute(query)
+            result = await conn.execute(self.check_exists_query, {'object_id': self.object_id})
         if not result.scalar():
             raise HTTPNotFound()
 
+    async def permission_denied(self) -> NoReturn:
+        await self.check_object_exists()
+        await super().permission_denied()
+
 
 class CheckUserPermissionMixin:
     skip_methods: list = []
     permissions_classes: list = []
+    permissions_objects: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Permissions are stateless, so they are instantiated once per view class
+        cls.permissions_objects = tuple(permission() for permission in cls.permissions_classes)
 
     async def _iter(self) -> StreamResponse:
         if self.request.method not in self.skip_methods:
@@ -39,22 +70,22 @@ class CheckUserPermissionMixin:
         return await super()._iter()
 
     async def check_permissions(self) -> NoReturn:
-        permissions_objects = [permission() for permission in self.permissions_classes]
-        for permission in permissions_objects:
+        for permission in self.permissions_objects:
             if not permission.has_permission(self.request, self):
-                raise HTTPForbidden(reason='You do not have permission to perform this action.')
+                await self.permission_denied()
+
+    async def permission_denied(self) -> NoReturn:
+        raise HTTPForbidden(reason='You do not have permission to perform this action.')
 
 
 class GetSerializedCartInfoMixin:
 
-    async def get_cart_response_data(self, user_id: int) -> dict:
-        cart_items_query = select(cartitems_t).where(cartitems_t.c.cart_id == user_id)
-        cart_total_price_query = (select(func.sum(cartitems_t.c.quantity * products_t.c.price))
-                                  .join(products_t)
-                                  .where(cartitems_t.c.cart_id == user_id))
-        async with self.engine.connect() as conn:
-            cart_items_result = await conn.execute(cart_items_query)
-            cart_total_price_result = await conn.execute(cart_total_price_query)
-        cart_items = cart_items_result.all()
-        cart_total_price = cart_total_price_result.scalar() or Decimal('0.00')
+    @staticmethod
+    async def get_cart_response_data(conn: AsyncConnection, user_id: int) -> dict:
+        cart_items_result = await conn.execute(CART_ITEMS_QUERY, {'cart_id': user_id})
+        cart_items, cart_total_price = [], EMPTY_CART_TOTAL_PRICE
+        for row in cart_items_result:
+            cart_items.append({'id': row.id, 'created': row.created, 'cart_id': row.cart_id,
+                               'product_id': row.product_id, 'quantity': row.quantity})
+            cart_total_price = row.total_price
         return {'user_id': user_id, 'total_price': cart_total_price, 'cart_items': cart_items}
@@ -1,23 +1,22 @@
-import json
 from datetime import datetime
 from decimal import Decimal
 from functools import partial
-from typing import Any
+from typing import Any, Callable
 
-from aiohttp.payload import JsonPayload as BaseJsonPayload, Payload
-from aiohttp.typedefs import JSONEncoder
+import orjson
+from aiohttp.payload import BytesPayload, Payload
 from sqlalchemy.engine import Row
 
 
-__all__ = ('JsonPayload', 'AsyncGenJSONListPayload')
+__all__ = ('JsonPayload', 'AsyncGenJSONListPayload', 'PreserializedAsyncGenJSONListPayload')
 
 
 def convert(value):
     """
-    The json module allows you to specify a function that will be called to process
+    The orjson module allows you to specify a function that will be called to process
     non-JSON-serializable objects. The function must return either a JSON-serializable
     value or a TypeError exception:
-    https://docs.python.org/3/library/json.html#json.dump
+    https://github.com/ijl/orjson#default
     """
     match value:
         case Row():
@@ -30,22 +29,23 @@ def convert(value):
             raise TypeError(f'Unserializable value: {value!r}')
 
 
-dumps = partial(json.dumps, default=convert, ensure_ascii=False)
+# orjson serializes straight to UTF-8 encoded bytes
+dumps = partial(orjson.dumps, default=convert, option=orjson.OPT_NON_STR_KEYS)
 
 
-class JsonPayload(BaseJsonPayload):
+class JsonPayload(BytesPayload):
     """
-    Replaces the serialization function with a smarter one (able to pack
+    Replaces the serialization function with a smarter and faster one (able to pack
     sqlalchemy.engine.Row and other entities into JSON objects).
     """
     def __init__(self,
                  value: Any,
                  encoding: str = 'utf-8',
                  content_type: str = 'application/json',
-                 dumps: JSONEncoder = dumps,
+                 dumps: Callable[[Any], bytes] = dumps,
                  *args: Any,
                  **kwargs: Any) -> None:
-        super().__init__(value, encoding, content_type, dumps, *args, **kwargs)
+        super().__init__(dumps(value), content_type=content_type, encoding=encoding, *args, **kwargs)
 
 
 class AsyncGenJSONListPayload(Payload):
@@ -53,6 +53,8 @@ class AsyncGenJSONListPayload(Payload):
     It iterates over AsyncIterable objects, serializes data from them in parts
     to JSON and sends it to the client.
     """
+    write_buffer_size = 16 * 1024  # 16 KiB
+
     def __init__(self, value, encoding: str = 'utf-8',
                  content_type: str = 'application/json',
                  root_object: str = 'data',
@@ -61,21 +63,35 @@ class AsyncGenJSONListPayload(Payload):
         super().__init__(value, content_type=content_type, encoding=encoding,
                          *args, **kwargs)
 
+    def serialize_row(self, row) -> bytes:
+        return dumps(row)
+
     async def write(self, writer):
+        # Rows are accumulated in buffer and sent in chunks to reduce the number of writes
         # Start of object
-        await writer.write(
-            (f'{{"{self.root_object}":[').encode(self._encoding)
-        )
+        buffer = bytearray(f'{{"{self.root_object}":['.encode(self._encoding))
 
         first = True
         async for row in self._value:
             # No comma required before the first line
             if not first:
-                await writer.write(b',')
+                buffer += b','
             else:
                 first = False
 
-            await writer.write(dumps(row).encode(self._encoding))
+            buffer += self.serialize_row(row)
+            if len(buffer) >= self.write_buffer_size:
+                await writer.write(bytes(buffer))
+                buffer.clear()
 
         # End of object
-        await writer.write(b']}')
+        buffer += b']}'
+        await writer.write(bytes(buffer))
+
+
+class PreserializedAsyncGenJSONListPayload(AsyncGenJSONListPayload):
+    """
+    Sends to the client the rows from AsyncIterable objects which are already JSON strings.
+    """
+    def serialize_row(self, row: str) -> bytes:
+        return row.encode(self._encoding)
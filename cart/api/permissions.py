@@ -26,6 +26,5 @@ class IsAuthenticatedForObject(BasePermission):
         """
         Return `True` if permission is granted or `user.is_admin == True`, `False` otherwise.
         """
-        has_perm = (request.get('payload', {}).get('user_id', -1) == view.user_id) or \
-            request.get('payload', {}).get('is_admin', False)
-        return has_perm
+        payload = request.get('payload', {})
+        return (payload.get('user_id', -1) == view.user_id) or payload.get('is_admin', False)
@@ -1,29 +1,37 @@
+from functools import cached_property
 from http import HTTPStatus
 
 from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response, StreamResponse
 from aiohttp.web_urldispatcher import View
 from aiohttp_apispec import docs, request_schema, response_schema
-from asyncpg import UniqueViolationError
+from asyncpg import ForeignKeyViolationError
 from marshmallow import ValidationError
-from sqlalchemy import select, text, exists
+from sqlalchemy import bindparam, select, exists
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 from cart.api import schema, mixins
 from cart.api.permissions import IsAuthenticatedForObject
-from cart.db.models import products_t, carts_t, cartitems_t
-from cart.utils import get_inner_exception, SelectQuery
+from cart.db.models import products_t, carts_t, cartitems_t, PRODUCTS_JSON_QUERY
+from cart.utils import get_inner_exception, JSONSelectQuery
 
 
 # swagger security schema
 jwt_security = [{'JWT Authorization': []}]
+# name of cart items foreign key to carts (see naming convention in models)
+CART_ID_FK_NAME = 'fk__cartitems__cart_id__carts'
+# Invariant queries are built once, their parameters are bound on execution
+CART_ITEM_OWNER_QUERY = select(cartitems_t.c.cart_id).where(cartitems_t.c.id == bindparam('item_id'))
+CART_ITEM_DELETE_QUERY = (cartitems_t.delete().where(cartitems_t.c.id == bindparam('item_id'))
+                          .returning(cartitems_t.c.id))
 
 
 class BaseView(View):
     URL_PATH: str
 
-    @property
+    @cached_property
     def engine(self) -> AsyncEngine:
         return self.request.app['engine']
 
@@ -44,10 +52,10 @@ class ProductsListAPIView(BaseView):
           }])
     @response_schema(schema.ProductsListResponseSchema(), code=HTTPStatus.OK.value)
     async def get(self):
-        products_query = select(products_t)
+        products_query = PRODUCTS_JSON_QUERY
         if search_term := self.request.query.get('search'):
             products_query = products_query.where(products_t.c.name.ilike(f'%{search_term}%'))
-        body = SelectQuery(query=products_query, transaction_ctx=self.engine.begin())
+        body = JSONSelectQuery(query=products_query, transaction_ctx=self.engine.begin())
         return Response(body=body, status=HTTPStatus.OK)
 
 
@@ -58,9 +66,9 @@ class CartRetrieveDestroyAPIView(mixins.CheckUserPermissionMixin, mixins.GetSeri
     URL_PATH = r'/api/v1/cart/{user_id:\d+}/'
     permissions_classes = [IsAuthenticatedForObject]
 
-    @property
+    @cached_property
     def user_id(self) -> int:
-        return int(self.request.match_info.get('user_id'))
+        return int(self.request.match_info['user_id'])
 
     @docs(tags=['cart'],
           summary="Retrieve user's cart",
@@ -68,15 +76,12 @@ class CartRetrieveDestroyAPIView(mixins.CheckUserPermissionMixin, mixins.GetSeri
           security=jwt_security)
     @response_schema(schema.CartResponseSchema(), code=HTTPStatus.OK.value)
     async def get(self):
-        # Check user's existing cart. If not - create a new one
         async with self.engine.begin() as conn:
-            cart_exists_result = await conn.execute(select(exists().where(carts_t.c.user_id == self.user_id)))
-            if not cart_exists_result.scalar():
-                await conn.execute(carts_t.insert().values(user_id=self.user_id))
-        # Get up-to-date information about user's cart
-        response_data = await self.get_cart_response_data(user_id=self.user_id)
-        return Response(body=schema.CartResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.OK)
+            # Create user's cart if it doesn't exist yet
+            await conn.execute(insert(carts_t).values(user_id=self.user_id).on_conflict_do_nothing())
+            # Get up-to-date information about user's cart
+            response_data = await self.get_cart_response_data(conn=conn, user_id=self.user_id)
+        return Response(body={'data': response_data}, status=HTTPStatus.OK)
 
     @docs(tags=['cart'],
           summary="Clean user's cart",
@@ -84,14 +89,13 @@ class CartRetrieveDestroyAPIView(mixins.CheckUserPermissionMixin, mixins.GetSeri
           security=jwt_security)
     @response_schema(schema.NoContentResponseSchema(), code=HTTPStatus.NO_CONTENT.value)
     async def delete(self):
-        # Check user's existing cart. If not - raise HTTPNotFound
+        # Delete all cart items and check user's existing cart in one query. If cart doesn't exist - raise HTTPNotFound
+        delete_cte = cartitems_t.delete().where(cartitems_t.c.cart_id == self.user_id).cte('deleted_cart_items')
+        delete_query = select(exists().where(carts_t.c.user_id == self.user_id)).add_cte(delete_cte)
         async with self.engine.begin() as conn:
-            cart_exists_result = await conn.execute(select(exists().where(carts_t.c.user_id == self.user_id)))
+            cart_exists_result = await conn.execute(delete_query)
             if not cart_exists_result.scalar():
                 raise HTTPNotFound()
-            else:
-                delete_query = cartitems_t.delete().where(cartitems_t.c.cart_id == self.user_id)
-                await conn.execute(delete_query)
         return Response(body={}, status=HTTPStatus.NO_CONTENT)
 
 
@@ -120,40 +124,47 @@ class CartItemCreateAPIView(mixins.CheckObjectExistsMixin, mixins.CheckUserPermi
         # (or disconnection of the client without waiting for a response).
         async with self.engine.begin() as conn:
             validated_data = self.request['validated_data']
-            # Create cart item with a check for uniqueness
+            # Create cart item. Duplicate of the product in cart is skipped by database without an error
+            insert_query = (insert(cartitems_t).values(**validated_data, cart_id=self.user_id)
+                            .on_conflict_do_nothing(index_elements=[cartitems_t.c.cart_id, cartitems_t.c.product_id])
+                            .returning(cartitems_t.c.id))
             try:
-                await conn.execute(cartitems_t.insert().values(**validated_data, cart_id=self.user_id))
+                insert_result = await conn.execute(insert_query)
             except IntegrityError as err:
-                if (inner_exc := get_inner_exception(err)) and isinstance(inner_exc, UniqueViolationError):
-                    raise ValidationError({
-                        "product_id": ["The product is already in cart. "
-                                       "Please change the product or just update it's quantity."]
-                    })
+                inner_exc = get_inner_exception(err)
+                if isinstance(inner_exc, ForeignKeyViolationError) and inner_exc.constraint_name == CART_ID_FK_NAME:
+                    raise HTTPNotFound()
                 else:  # pragma: no cover
                     raise ValidationError({'non_field_errors': ['Failed to add this product to cart.']})
-        # Get up-to-date information about user's cart
-        response_data = await self.get_cart_response_data(user_id=self.user_id)
-        return Response(body=schema.CartResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.CREATED)
+            if insert_result.first() is None:
+                raise ValidationError({
+                    "product_id": ["The product is already in cart. "
+                                   "Please change the product or just update it's quantity."]
+                })
+            # Get up-to-date information about user's cart
+            response_data = await self.get_cart_response_data(conn=conn, user_id=self.user_id)
+        return Response(body={'data': response_data}, status=HTTPStatus.CREATED)
 
 
-class CartItemUpdateDestroyAPIView(mixins.CheckObjectExistsMixin, mixins.CheckUserPermissionMixin,
+class CartItemUpdateDestroyAPIView(mixins.ObjectIdMixin, mixins.CheckUserPermissionMixin,
                                    mixins.GetSerializedCartInfoMixin, BaseView):
     """
     Updates quantity or deletes cart item from user's cart.
     """
     URL_PATH = r'/api/v1/cart-item/{item_id:\d+}/'
     object_id_path = 'item_id'
-    check_exists_column = cartitems_t.c.id
     permissions_classes = [IsAuthenticatedForObject]
 
     async def get_user_id(self) -> int:
         async with self.engine.connect() as conn:
-            result = await conn.execute(select(cartitems_t.c.cart_id).where(cartitems_t.c.id == self.object_id))
+            result = await conn.execute(CART_ITEM_OWNER_QUERY, {'item_id': self.object_id})
         return result.scalar()
 
     async def _iter(self) -> StreamResponse:
-        self.user_id = await self.get_user_id()
+        # Getting of cart item's owner also checks that cart item exists
+        if (user_id := await self.get_user_id()) is None:
+            raise HTTPNotFound()
+        self.user_id = user_id
         return await super()._iter()
 
     @docs(tags=['cart-item'],
@@ -165,15 +176,16 @@ class CartItemUpdateDestroyAPIView(mixins.CheckObjectExistsMixin, mixins.CheckUs
     async def patch(self):
         async with self.engine.begin() as conn:
             validated_data = self.request['validated_data']
-            # Blocking will avoid race conditions between concurrent update requests
-            await conn.execute(text('SELECT pg_advisory_xact_lock(:lid)').bindparams(lid=self.object_id))
-            # Update query
-            patch_query = cartitems_t.update().values(validated_data).where(cartitems_t.c.id == self.object_id)
-            await conn.execute(patch_query)
-        # Get up-to-date information about user's cart
-        response_data = await self.get_cart_response_data(user_id=self.user_id)
-        return Response(body=schema.CartResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.OK)
+            # UPDATE locks the cart item's row until the end of transaction, concurrent updates wait for it
+            patch_query = (cartitems_t.update().values(validated_data).where(cartitems_t.c.id == self.object_id)
+                           .returning(cartitems_t.c.id))
+            patch_result = await conn.execute(patch_query)
+            # Cart item could be deleted by concurrent request
+            if patch_result.first() is None:
+                raise HTTPNotFound()
+            # Get up-to-date information about user's cart
+            response_data = await self.get_cart_response_data(conn=conn, user_id=self.user_id)
+        return Response(body={'data': response_data}, status=HTTPStatus.OK)
 
     @docs(tags=['cart-item'],
           summary='Delete cart item',
@@ -181,7 +193,9 @@ class CartItemUpdateDestroyAPIView(mixins.CheckObjectExistsMixin, mixins.CheckUs
           security=jwt_security)
     @response_schema(schema.NoContentResponseSchema(), code=HTTPStatus.NO_CONTENT.value)
     async def delete(self):
-        delete_query = cartitems_t.delete().where(cartitems_t.c.id == self.object_id)
         async with self.engine.begin() as conn:
-            await conn.execute(delete_query)
+            delete_result = await conn.execute(CART_ITEM_DELETE_QUERY, {'item_id': self.object_id})
+            # Cart item could be deleted by concurrent request
+            if delete_result.first() is None:
+                raise HTTPNotFound()
         return Response(body={}, status=HTTPStatus.NO_CONTENT)
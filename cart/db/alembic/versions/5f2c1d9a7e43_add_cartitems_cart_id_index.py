@@ -0,0 +1,25 @@
+"""Add cartitems cart_id covering index
+
+Revision ID: 5f2c1d9a7e43
+Revises: 2560f7762880data
+Create Date: 2026-10-15 12:04:21.318415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c1d9a7e43'
+down_revision = '2560f7762880data'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix__cartitems__cart_id'), 'cartitems', ['cart_id'], unique=False,
+                    postgresql_include=['id', 'created', 'product_id', 'quantity'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix__cartitems__cart_id'), table_name='cartitems')
@@ -0,0 +1,24 @@
+"""Add cartitems product_id index
+
+Revision ID: a83e6b0c4d17
+Revises: 5f2c1d9a7e43
+Create Date: 2026-10-15 12:31:07.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83e6b0c4d17'
+down_revision = '5f2c1d9a7e43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix__cartitems__product_id'), 'cartitems', ['product_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix__cartitems__product_id'), table_name='cartitems')
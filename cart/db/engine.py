@@ -0,0 +1,25 @@
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from cart import settings
+
+
+def create_engine(pg_url: str | None = None, **kwargs) -> AsyncEngine:
+    """
+    Creates an async database engine with a connection pool configured by settings.
+    Any engine option can be overridden with kwargs.
+    """
+    options = {
+        'echo': settings.DEBUG,
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+        'query_cache_size': settings.DB_QUERY_CACHE_SIZE,
+        'connect_args': {'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+                         'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE},
+    }
+    options.update(kwargs)
+    return create_async_engine(pg_url or settings.DB_URL, **options)
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, Numeric, SmallInteger, String, Text, \
-    UniqueConstraint
+from functools import cache
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, Numeric, SmallInteger, String, Text, \
+    UniqueConstraint, cast, func, literal_column, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy.orm import relationship
@@ -32,8 +34,20 @@ class Base:
     def __tablename__(cls):
         return f"{cls.__name__.lower()}s"
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._repr_cls = cls.__name__
+
     def __repr__(self):
-        return f"[{self.id}] {self.__class__.__name__}"
+        return f"[{self.id}] {self._repr_cls}"
+
+    @classmethod
+    @cache
+    def _insert_cols(cls) -> tuple[Column, ...]:
+        """
+        Table columns of the model, which are memoized for each model class.
+        """
+        return tuple(cls.__table__.columns)
 
     async def async_save(self, db_session: AsyncSession):
         """
@@ -62,7 +76,7 @@ class Cart(Base):
     cart_items = relationship('CartItem', back_populates='cart')
 
     def __repr__(self):
-        return f"[{self.user_id}] {self.__class__.__name__}"
+        return f"[{self.user_id}] {self._repr_cls}"
 
 
 class CartItem(BaseIdCreated):
@@ -74,6 +88,10 @@ class CartItem(BaseIdCreated):
 
     __table_args__ = (
         UniqueConstraint('cart_id', 'product_id'),
+        # Covering index for cart items retrieval, allows index-only scans
+        Index(None, 'cart_id', postgresql_include=['id', 'created', 'product_id', 'quantity']),
+        # Foreign key index for joins with products and cascades on products deletion
+        Index(None, 'product_id'),
     )
 
 
@@ -81,3 +99,11 @@ class CartItem(BaseIdCreated):
 products_t = Product.__table__
 carts_t = Cart.__table__
 cartitems_t = CartItem.__table__
+
+# Queries preset
+# Products are serialized to JSON by PostgreSQL, price is passed as a string to keep its precision
+PRODUCT_JSON_FIELDS = {'id': products_t.c.id, 'created': products_t.c.created, 'name': products_t.c.name,
+                       'description': products_t.c.description, 'price': cast(products_t.c.price, Text)}
+PRODUCTS_JSON_QUERY = select(cast(func.json_build_object(*(
+    arg for key, column in PRODUCT_JSON_FIELDS.items() for arg in (literal_column(f"'{key}'"), column)
+)), Text))
@@ -0,0 +1,34 @@
+import time
+
+from cart import settings
+from cart.api.middleware import TOKEN_CACHE, get_token_cache_key, get_cached_token_payload, cache_token_payload
+
+
+async def test_token_cache(monkeypatch):
+    monkeypatch.setattr(settings, 'JWT_CACHE_MAX_SIZE', 10)
+    TOKEN_CACHE.clear()
+    payload = {'user_id': 1, 'is_admin': False, 'exp': time.time() + 3600}
+    token_key = get_token_cache_key('Bearer token')
+    assert token_key != 'Bearer token'.encode()  # raw token is not stored
+    assert get_cached_token_payload(token_key) is None
+
+    # Cached payload is returned while not expired
+    cache_token_payload(token_key, payload)
+    assert get_cached_token_payload(token_key) == payload
+
+    # Payload of the expired token is not cached
+    cache_token_payload(token_key, {**payload, 'exp': time.time() - 1})
+    assert get_cached_token_payload(token_key) is None
+
+    # Expired payload is dropped
+    monkeypatch.setattr(settings, 'JWT_CACHE_TTL', -1)
+    cache_token_payload(token_key, payload)
+    assert get_cached_token_payload(token_key) is None
+    assert token_key not in TOKEN_CACHE
+
+    # The oldest entries are evicted when the cache is full
+    for i in range(settings.JWT_CACHE_MAX_SIZE + 1):
+        cache_token_payload(get_token_cache_key(f'Bearer token_{i}'), payload)
+    assert len(TOKEN_CACHE) == settings.JWT_CACHE_MAX_SIZE
+    assert get_token_cache_key('Bearer token_0') not in TOKEN_CACHE
+    TOKEN_CACHE.clear()
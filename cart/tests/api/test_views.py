@@ -1,33 +1,60 @@
+import asyncio
 from http import HTTPStatus
 
+import factory
+import orjson
 from aiohttp import ClientResponse
-from sqlalchemy import select, func, desc, exists
+from sqlalchemy import select, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from cart.api.middleware import TOKEN_CACHE
 from cart.db.factories import ProductFactory, CartFactory, CartItemFactory
 from cart.db.models import Product, Cart, CartItem
 from cart.api import views, schema
-from cart.utils import url_for, add_objects_to_db
+from cart.utils import url_for, add_objects_to_db, bulk_insert
 
 
 ADDITIONAL_OBJECTS_QUANTITY = 5
+NONEXISTENT_ID = 2 ** 31 - 1  # tables are truncated before each test, so ids never get that big
+# Schemas are created once and reused for responses validation
+PRODUCTS_LIST_RESPONSE_SCHEMA = schema.ProductsListResponseSchema()
+CART_RESPONSE_SCHEMA = schema.CartResponseSchema()
+
+
+async def get_cart_and_carts_count(user_id: int, db_session: AsyncSession) -> tuple[Cart, int]:
+    """
+    Returns user's cart and total quantity of carts in one round-trip to the database.
+    """
+    carts_count = select(func.count(Cart.user_id)).correlate(None).scalar_subquery()
+    result = await db_session.execute(select(Cart, carts_count).filter_by(user_id=user_id))
+    return result.one()
+
+
+async def get_response_data(response: ClientResponse, status: HTTPStatus) -> dict:
+    """
+    Checks response status and content type, returns response data.
+    """
+    assert response.status == status
+    assert response.content_type == 'application/json'
+    return await response.json(loads=orjson.loads)
+
+
+async def check_cart_cleared(user_id: int, db_session: AsyncSession) -> None:
+    result = await db_session.execute(select(exists().where(Cart.user_id == user_id).label('cart_exists'),
+                                             exists().where(CartItem.cart_id == user_id).label('cart_items_exist')))
+    cart_exists, cart_items_exist = result.one()
+    assert cart_exists  # cart not deleted
+    assert not cart_items_exist  # but all cart items deleted
 
 
 async def check_response_for_objects_exists(response: ClientResponse) -> None:
-    # Response checks
-    assert response.status == HTTPStatus.NOT_FOUND
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.NOT_FOUND)
     assert response_data['error']['code'] == 'not_found'
     assert response_data['error']['message'] == '404: Not Found'
 
 
 async def check_response_for_authorized_user_permissions(response: ClientResponse) -> None:
-    # Response checks
-    assert response.status == HTTPStatus.FORBIDDEN
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.FORBIDDEN)
     assert response_data['error']['code'] == 'forbidden'
     assert response_data['error']['message'] == '403: You do not have permission to perform this action.'
 
@@ -37,68 +64,61 @@ async def check_response_for_authorized_user_permissions(response: ClientRespons
 #####################################################################
 async def test_grpc_server_errors(authorized_api_client):
     api_client, non_admin_jwt, _, user_id = authorized_api_client
-    # Send request without Authorization header
-    response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id))
-    # Response checks
-    assert response.status == HTTPStatus.FORBIDDEN
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    assert response_data['error']['code'] == 'forbidden'
-    assert response_data['error']['message'] == '403: Invalid authorization header'
+    url = url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id)
+    # Authorization header (None - without header) and expected error message
+    cases = (
+        (None, '403: Invalid authorization header'),
+        ('qwasddqwd', '403: Invalid JWT token'),
+        ('Beareraaa qwasddqwd', '403: Invalid token scheme'),
+    )
+    # Requests are independent, so they are sent concurrently with per-request headers
+    responses = await asyncio.gather(*(
+        api_client.get(url, headers={'Authorization': token} if token is not None else None)
+        for token, _ in cases
+    ))
+    for response, (_, message) in zip(responses, cases):
+        response_data = await get_response_data(response, HTTPStatus.FORBIDDEN)
+        assert response_data['error']['code'] == 'forbidden'
+        assert response_data['error']['message'] == message
+
+
+async def test_validated_token_is_cached(authorized_api_client, db_session, monkeypatch):
+    api_client, non_admin_jwt, _, user_id = authorized_api_client
+    api_client._session.headers["Authorization"] = non_admin_jwt
+    url = url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id)
+    TOKEN_CACHE.clear()
+    # The first request validates the token via gRPC
+    response = await api_client.get(url)
+    await get_response_data(response, HTTPStatus.OK)
 
-    # Send request with invalid JWT token
-    api_client._session.headers["Authorization"] = 'qwasddqwd'
-    response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id))
-    # Response checks
-    assert response.status == HTTPStatus.FORBIDDEN
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    assert response_data['error']['code'] == 'forbidden'
-    assert response_data['error']['message'] == '403: Invalid JWT token'
+    async def validate_token(*args, **kwargs):
+        raise AssertionError('Cached token is validated again')
 
-    # Send request with invalid JWT token scheme
-    api_client._session.headers["Authorization"] = 'Beareraaa qwasddqwd'
-    response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id))
-    # Response checks
-    assert response.status == HTTPStatus.FORBIDDEN
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    assert response_data['error']['code'] == 'forbidden'
-    assert response_data['error']['message'] == '403: Invalid token scheme'
+    # Repeated request with the same token doesn't call the customers service
+    monkeypatch.setattr(api_client.server.app['grpc_client'], 'ValidateToken', validate_token)
+    response = await api_client.get(url)
+    await get_response_data(response, HTTPStatus.OK)
 
 
 async def test_get_products_list(authorized_api_client, db_session):
     api_client, _, _, _ = authorized_api_client
     # Creates products pool
-    result = await db_session.execute(select(func.count(Product.id)))
-    initial_products_quantity = result.scalar()
-    additional_products = [ProductFactory() for _ in range(ADDITIONAL_OBJECTS_QUANTITY - 1)]
-    lost_product = ProductFactory(name='Find_me_if_u_can')  # additional product with non-random name
-    additional_products.append(lost_product)
-    await add_objects_to_db(objects_list=additional_products, db_session=db_session)
+    additional_products = factory.build_batch(dict, ADDITIONAL_OBJECTS_QUANTITY - 1, FACTORY_CLASS=ProductFactory)
+    # additional product with non-random name
+    additional_products.append(factory.build(dict, FACTORY_CLASS=ProductFactory, name='Find_me_if_u_can'))
+    *_, lost_product = await bulk_insert(model=Product, rows=additional_products, db_session=db_session)
 
     # Get all products
     response = await api_client.get(url_for(views.ProductsListAPIView.URL_PATH))
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.ProductsListResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = PRODUCTS_LIST_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
-    assert len(response_data['data']) == initial_products_quantity + ADDITIONAL_OBJECTS_QUANTITY
+    assert len(response_data['data']) == ADDITIONAL_OBJECTS_QUANTITY
 
     # Filter by name
     response = await api_client.get(url_for(views.ProductsListAPIView.URL_PATH), params={'search': 'Find_me'})
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.ProductsListResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = PRODUCTS_LIST_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert len(response_data['data']) == 1
     assert response_data['data'][0]['id'] == lost_product.id
@@ -110,27 +130,20 @@ async def test_get_products_list(authorized_api_client, db_session):
 async def test_retrieve_destroy_cart(authorized_api_client, db_session):
     api_client, non_admin_jwt, admin_jwt, user_id = authorized_api_client
     other_user_id = user_id + 100500
-    result = await db_session.execute(select(func.count(Cart.user_id)))
+    result = await db_session.execute(select(exists().select_from(Cart)))
     assert not result.scalar()  # carts table is empty
     api_client._session.headers["Authorization"] = non_admin_jwt
 
     # Get info about a non-existent user's cart
     response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_id))
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == user_id
     assert response_data['data']['total_price'] == '0.00'
     assert not response_data['data']['cart_items']  # empty list
-    result = await db_session.execute(select(func.count(Cart.user_id)))
-    assert result.scalar() == 1
-    user_cart_result = await db_session.execute(select(Cart).filter_by(user_id=user_id))
-    user_cart = user_cart_result.scalar()
-    assert user_cart
+    user_cart, carts_count = await get_cart_and_carts_count(user_id, db_session)
+    assert carts_count == 1
 
     # Get info about existent user's cart
     # Create new cart with cart item
@@ -139,12 +152,8 @@ async def test_retrieve_destroy_cart(authorized_api_client, db_session):
     result = await db_session.execute(select(func.count(Cart.user_id)))
     assert result.scalar() == 1
     response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_cart.user_id))
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == user_cart.user_id
     assert response_data['data']['total_price'] == str(cart_item.product.price * cart_item.quantity)
@@ -160,17 +169,10 @@ async def test_retrieve_destroy_cart(authorized_api_client, db_session):
 
     # Clear an existent user's cart
     response = await api_client.delete(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=user_cart.user_id))
-    # Response checks
-    assert response.status == HTTPStatus.NO_CONTENT
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.NO_CONTENT)
     assert not response_data
     # DB check
-    result = await db_session.execute(select(exists().where(Cart.user_id == user_cart.user_id)))
-    assert result.scalar()  # cart not deleted
-    result = await db_session.execute(select(exists().where(CartItem.cart_id == user_cart.user_id)))
-    assert not result.scalar()  # but all cart items deleted
+    await check_cart_cleared(user_cart.user_id, db_session)
 
     # Attempt to clear other user's cart
     response = await api_client.delete(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=other_user_id))
@@ -182,21 +184,14 @@ async def test_retrieve_destroy_cart(authorized_api_client, db_session):
     assert result.scalar() == 1
     # Get info about a non-existent other user's cart
     response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=other_user_id))
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == other_user_id
     assert response_data['data']['total_price'] == '0.00'
     assert not response_data['data']['cart_items']  # empty list
-    result = await db_session.execute(select(func.count(Cart.user_id)))
-    assert result.scalar() == 2
-    other_user_cart_result = await db_session.execute(select(Cart).filter_by(user_id=other_user_id))
-    other_user_cart = other_user_cart_result.scalar()
-    assert other_user_cart
+    other_user_cart, carts_count = await get_cart_and_carts_count(other_user_id, db_session)
+    assert carts_count == 2
 
     # Get info about existent other user's cart
     # Create new cart with cart item
@@ -205,12 +200,8 @@ async def test_retrieve_destroy_cart(authorized_api_client, db_session):
     result = await db_session.execute(select(func.count(Cart.user_id)))
     assert result.scalar() == 2
     response = await api_client.get(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=other_user_cart.user_id))
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == other_user_cart.user_id
     assert response_data['data']['total_price'] == str(other_cart_item.product.price * other_cart_item.quantity)
@@ -223,22 +214,13 @@ async def test_retrieve_destroy_cart(authorized_api_client, db_session):
     # Clear an existent other user's cart
     response = await api_client.delete(url_for(views.CartRetrieveDestroyAPIView.URL_PATH,
                                                user_id=other_user_cart.user_id))
-    # Response checks
-    assert response.status == HTTPStatus.NO_CONTENT
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.NO_CONTENT)
     assert not response_data
     # DB check
-    result = await db_session.execute(select(exists().where(Cart.user_id == other_user_cart.user_id)))
-    assert result.scalar()  # cart not deleted
-    result = await db_session.execute(select(exists().where(CartItem.cart_id == other_user_cart.user_id)))
-    assert not result.scalar()  # but all cart items deleted
+    await check_cart_cleared(other_user_cart.user_id, db_session)
 
     # Clear a non-existent other user's cart
-    result = await db_session.execute(select(Cart.user_id).order_by(desc(Cart.user_id)).limit(1))
-    last_id = result.scalar() or 0
-    response = await api_client.delete(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=last_id + 100))
+    response = await api_client.delete(url_for(views.CartRetrieveDestroyAPIView.URL_PATH, user_id=NONEXISTENT_ID))
     await check_response_for_objects_exists(response)
 
 
@@ -246,11 +228,9 @@ async def test_create_cart_item(authorized_api_client, db_session):
     api_client, non_admin_jwt, admin_jwt, user_id = authorized_api_client
     api_client._session.headers["Authorization"] = non_admin_jwt
     cart = CartFactory(user_id=user_id)
-    await cart.async_save(db_session=db_session)
     other_cart = CartFactory()
-    await other_cart.async_save(db_session=db_session)
     product = ProductFactory()
-    await product.async_save(db_session=db_session)
+    await add_objects_to_db(objects_list=[cart, other_cart, product], db_session=db_session)
 
     # Try to create cart_item without all required fields
     partial_data = {
@@ -258,11 +238,7 @@ async def test_create_cart_item(authorized_api_client, db_session):
     }
     response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=cart.user_id),
                                      data=partial_data)
-    # Response checks
-    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.UNPROCESSABLE_ENTITY)
     assert len(response_data['error']['fields'].keys()) == 1
     assert response_data['error']['fields'].keys() == {'product_id'}
 
@@ -273,17 +249,13 @@ async def test_create_cart_item(authorized_api_client, db_session):
     }
     response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=cart.user_id),
                                      data=invalid_data)
-    # Response checks
-    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.UNPROCESSABLE_ENTITY)
     assert len(response_data['error']['fields'].keys()) == 1
     assert response_data['error']['fields']['quantity'][0] == 'Must be greater than or equal to 1 and less than ' \
                                                               'or equal to 5.'
 
     # Create a new cart_item
-    result = await db_session.execute(select(func.count(CartItem.id)).where(CartItem.cart_id == cart.user_id))
+    result = await db_session.execute(select(exists().where(CartItem.cart_id == cart.user_id)))
     assert not result.scalar()  # cart is empty
     cart_item_data = {
         'product_id': product.id,
@@ -291,12 +263,8 @@ async def test_create_cart_item(authorized_api_client, db_session):
     }
     response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=cart.user_id),
                                      data=cart_item_data)
-    # Response checks
-    assert response.status == HTTPStatus.CREATED
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.CREATED)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == cart.user_id
     assert response_data['data']['total_price'] == str(product.price * cart_item_data['quantity'])
@@ -305,25 +273,18 @@ async def test_create_cart_item(authorized_api_client, db_session):
     assert response_data['data']['cart_items'][0]['cart_id'] == cart.user_id
     assert response_data['data']['cart_items'][0]['quantity'] == cart_item_data['quantity']
     # DB check
-    result = await db_session.execute(select(CartItem).filter_by(cart_id=cart.user_id))
-    cart_item_from_db = result.scalar()
+    cart_item_query = select(CartItem.quantity, CartItem.product_id).filter_by(cart_id=cart.user_id)
+    result = await db_session.execute(cart_item_query)
+    cart_item_from_db = result.first()
     assert cart_item_from_db
     assert cart_item_from_db.quantity == cart_item_data['quantity']
     assert cart_item_from_db.product_id == product.id
 
     # Try to create cart_item with same product
-    duplicate_cart_item_data = cart_item_data
-    # Check cart_item exists
-    result = await db_session.execute(select(CartItem).filter_by(product_id=duplicate_cart_item_data['product_id'],
-                                                                 cart_id=cart.user_id))
-    assert result.first()
+    duplicate_cart_item_data = cart_item_data  # cart_item with this product is checked above
     response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=cart.user_id),
                                      data=duplicate_cart_item_data)
-    # Response checks
-    assert response.status == HTTPStatus.BAD_REQUEST
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.BAD_REQUEST)
     assert len(response_data['error']['fields'].keys()) == 1
     assert response_data['error']['fields']['product_id'][0] == "The product is already in cart. Please change " \
                                                                 "the product or just update it's quantity."
@@ -337,17 +298,18 @@ async def test_create_cart_item(authorized_api_client, db_session):
                                      data=other_cart_item_data)
     await check_response_for_authorized_user_permissions(response)
 
+    # Try to create cart item in the non-existing cart, existence is checked before permissions
+    response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=NONEXISTENT_ID),
+                                     data=other_cart_item_data)
+    await check_response_for_objects_exists(response)
+
     # Admin-user actions
     api_client._session.headers["Authorization"] = admin_jwt
     # Create a new cart_item in the other cart
     response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=other_cart.user_id),
                                      data=other_cart_item_data)
-    # Response checks
-    assert response.status == HTTPStatus.CREATED
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.CREATED)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == other_cart.user_id
     assert response_data['data']['total_price'] == str(product.price * other_cart_item_data['quantity'])
@@ -356,16 +318,15 @@ async def test_create_cart_item(authorized_api_client, db_session):
     assert response_data['data']['cart_items'][0]['cart_id'] == other_cart.user_id
     assert response_data['data']['cart_items'][0]['quantity'] == other_cart_item_data['quantity']
     # DB check
-    result = await db_session.execute(select(CartItem).filter_by(cart_id=other_cart.user_id))
-    cart_item_from_db = result.scalar()
+    cart_item_query = select(CartItem.quantity, CartItem.product_id).filter_by(cart_id=other_cart.user_id)
+    result = await db_session.execute(cart_item_query)
+    cart_item_from_db = result.first()
     assert cart_item_from_db
     assert cart_item_from_db.quantity == other_cart_item_data['quantity']
     assert cart_item_from_db.product_id == product.id
 
     # Try to create cart item in the non-existing cart
-    result = await db_session.execute(select(Cart.user_id).order_by(desc(Cart.user_id)).limit(1))
-    last_id = result.scalar() or 0
-    response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=last_id + 100),
+    response = await api_client.post(url_for(views.CartItemCreateAPIView.URL_PATH, cart_id=NONEXISTENT_ID),
                                      data=other_cart_item_data)
     await check_response_for_objects_exists(response)
 
@@ -374,19 +335,14 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
     api_client, non_admin_jwt, admin_jwt, user_id = authorized_api_client
     api_client._session.headers["Authorization"] = non_admin_jwt
     cart_item = CartItemFactory(cart=CartFactory(user_id=user_id))
-    await cart_item.async_save(db_session=db_session)
     other_cart_item = CartItemFactory()
-    await other_cart_item.async_save(db_session=db_session)
+    await add_objects_to_db(objects_list=[cart_item, other_cart_item], db_session=db_session)
 
     # Attempt to update cart_item with invalid quantity
     invalid_patch_data = {'quantity': 6}
     response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=cart_item.id),
                                       data=invalid_patch_data)
-    # Response checks
-    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.UNPROCESSABLE_ENTITY)
     assert len(response_data['error']['fields'].keys()) == 1
     assert response_data['error']['fields']['quantity'][0] == 'Must be greater than or equal to 1 and less than ' \
                                                               'or equal to 5.'
@@ -396,12 +352,8 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
     valid_patch_data = {'quantity': new_quantity}
     response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=cart_item.id),
                                       data=valid_patch_data)
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == cart_item.cart.user_id
     assert response_data['data']['total_price'] == str(cart_item.product.price * new_quantity)
@@ -409,9 +361,6 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
     assert response_data['data']['cart_items'][0]['product_id'] == cart_item.product_id
     assert response_data['data']['cart_items'][0]['cart_id'] == cart_item.cart_id
     assert response_data['data']['cart_items'][0]['quantity'] == new_quantity
-    # DB check
-    await db_session.refresh(cart_item)  # get updates from db
-    assert cart_item.quantity == new_quantity
 
     # Attempt to update other cart_item
     response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=other_cart_item.id),
@@ -420,11 +369,7 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
 
     # Delete cart_item
     response = await api_client.delete(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=cart_item.id))
-    # Response checks
-    assert response.status == HTTPStatus.NO_CONTENT
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.NO_CONTENT)
     assert not response_data
     # DB check
     result = await db_session.execute(select(exists().where(CartItem.id == cart_item.id)))
@@ -442,12 +387,8 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
     valid_patch_data = {'quantity': new_quantity}
     response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=other_cart_item.id),
                                       data=valid_patch_data)
-    # Response checks
-    assert response.status == HTTPStatus.OK
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
-    errors = schema.CartResponseSchema().validate(response_data)
+    response_data = await get_response_data(response, HTTPStatus.OK)
+    errors = CART_RESPONSE_SCHEMA.validate(response_data)
     assert not errors
     assert response_data['data']['user_id'] == other_cart_item.cart.user_id
     assert response_data['data']['total_price'] == str(other_cart_item.product.price * new_quantity)
@@ -455,31 +396,20 @@ async def test_update_destroy_cart_item(authorized_api_client, db_session):
     assert response_data['data']['cart_items'][0]['product_id'] == other_cart_item.product_id
     assert response_data['data']['cart_items'][0]['cart_id'] == other_cart_item.cart_id
     assert response_data['data']['cart_items'][0]['quantity'] == new_quantity
-    # DB check
-    await db_session.refresh(other_cart_item)  # get updates from db
-    assert other_cart_item.quantity == new_quantity
 
     # Attempt to update not exists cart_item
-    result = await db_session.execute(select(CartItem.id).order_by(desc(CartItem.id)).limit(1))
-    last_id = result.scalar() or 0
-    response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=last_id + 100),
+    response = await api_client.patch(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=NONEXISTENT_ID),
                                       data=valid_patch_data)
     await check_response_for_objects_exists(response)
 
     # Delete other cart_item
     response = await api_client.delete(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=other_cart_item.id))
-    # Response checks
-    assert response.status == HTTPStatus.NO_CONTENT
-    assert response.content_type == 'application/json'
-    # Response data checks
-    response_data = await response.json()
+    response_data = await get_response_data(response, HTTPStatus.NO_CONTENT)
     assert not response_data
     # DB check
     result = await db_session.execute(select(exists().where(CartItem.id == other_cart_item.id)))
     assert not result.scalar()
 
     # Attempt to delete not exists cart_item
-    result = await db_session.execute(select(CartItem.id).order_by(desc(CartItem.id)).limit(1))
-    last_id = result.scalar() or 0
-    response = await api_client.delete(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=last_id + 100))
+    response = await api_client.delete(url_for(views.CartItemUpdateDestroyAPIView.URL_PATH, item_id=NONEXISTENT_ID))
     await check_response_for_objects_exists(response)
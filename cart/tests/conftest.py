@@ -1,44 +1,60 @@
 import asyncio
+import os
+import re
 import uuid
 from argparse import Namespace
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import aiohttp
+import orjson
 import pytest
+from aiohttp.test_utils import TestClient, TestServer
 from alembic.config import Config
 from sqlalchemy import text
 from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession as BaseAsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from yarl import URL
 
 from cart import settings
 from cart.api.app import create_app
+from cart.db.engine import create_engine
 from cart.db.models import metadata
 from cart.settings import DB_URL
 from cart.utils import make_alembic_config
 
 
 POSTGRES_DEFAULT_DB = "postgres"
+# Database name is used in statements as identifier, so it's checked
+DATABASE_NAME_RE = re.compile(r'^[\w.]+$')
+# Tests repeat the same small queries many times: cache their prepared statements and don't spend time on JIT.
+# Temporary test database is dropped anyway, so commits don't have to wait for WAL flush
+TEST_DB_CONNECT_ARGS = {
+    'statement_cache_size': 1024,
+    'prepared_statement_cache_size': 1024,
+    'server_settings': {'jit': 'off', 'synchronous_commit': 'off', 'client_min_messages': 'warning'},
+}
+# Cleaning tables is much cheaper than recreating the schema for each test
+TRUNCATE_TABLES_QUERY = text(f'TRUNCATE {", ".join(table.name for table in metadata.sorted_tables)} '
+                             'RESTART IDENTITY CASCADE')
 
 
 async def create_database(url: str):
     """Issue the appropriate CREATE DATABASE statement.
 
     To create a database, you can pass a simple URL that would have
-    been passed to `create_async_engine`.
+    been passed to `create_async_engine`. Database names are unique,
+    so it's not checked whether the database already exists.
     """
     url_object = make_url(url)
     database_name = url_object.database
+    assert DATABASE_NAME_RE.match(database_name), f'Invalid test database name: {database_name}'
     dbms_url = url_object.set(database=POSTGRES_DEFAULT_DB)
-    engine = create_async_engine(dbms_url, isolation_level="AUTOCOMMIT")
+    engine = create_async_engine(dbms_url, isolation_level="AUTOCOMMIT", poolclass=NullPool)
     async with engine.connect() as conn:
-        c = await conn.execute(text(f"SELECT 1 FROM pg_database WHERE datname='{database_name}'"))
-        database_exists = c.scalar() == 1
-    if database_exists:
-        await drop_database(url_object)
-
-    async with engine.connect() as conn:
-        await conn.execute(text(f'CREATE DATABASE "{database_name}" ENCODING "utf8" TEMPLATE template1'))
+        await conn.execute(text(f'CREATE DATABASE "{database_name}" ENCODING "utf8" TEMPLATE template0'))
     await engine.dispose()
 
 
@@ -49,22 +65,24 @@ async def drop_database(url: str):
     and a constructed url are accepted.
     """
     url_object = make_url(url)
+    database_name = url_object.database
+    assert DATABASE_NAME_RE.match(database_name), f'Invalid test database name: {database_name}'
     dbms_url = url_object.set(database=POSTGRES_DEFAULT_DB)
-    engine = create_async_engine(dbms_url, isolation_level="AUTOCOMMIT")
+    engine = create_async_engine(dbms_url, isolation_level="AUTOCOMMIT", poolclass=NullPool)
     async with engine.connect() as conn:
-        disc_users = """
-        SELECT pg_terminate_backend(pg_stat_activity.{pid_column})
+        disc_users = text("""
+        SELECT pg_terminate_backend(pg_stat_activity.pid)
         FROM pg_stat_activity
-        WHERE pg_stat_activity.datname = '{database}'
-          AND {pid_column} != pg_backend_pid();
-        """.format(pid_column="pid", database=url_object.database)
-        await conn.execute(text(disc_users))
+        WHERE pg_stat_activity.datname = :database
+          AND pid != pg_backend_pid();
+        """)
+        await conn.execute(disc_users, {'database': database_name})
 
-        await conn.execute(text(f'DROP DATABASE "{url_object.database}"'))
+        await conn.execute(text(f'DROP DATABASE "{database_name}"'))
     await engine.dispose()
 
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def event_loop() -> asyncio.AbstractEventLoop:
     """
     Creates an instance of the default event loop for the test session.
@@ -76,12 +94,13 @@ def event_loop() -> asyncio.AbstractEventLoop:
         loop.close()
 
 
-@pytest.fixture(scope="module")
-async def postgres_url() -> str:
+@asynccontextmanager
+async def tmp_database() -> AsyncIterator[str]:
     """
-    Creates a temporary database and yield db_url.
+    Creates a temporary database, yields its url and drops it on exit.
     """
-    tmp_name = '.'.join([uuid.uuid4().hex, 'pytest'])
+    # Each pytest-xdist worker runs its own test session, so it gets its own database
+    tmp_name = '.'.join([uuid.uuid4().hex, os.environ.get('PYTEST_XDIST_WORKER', 'gw0'), 'pytest'])
     db_url = str(URL(DB_URL).with_path(tmp_name))
     await create_database(db_url)
     try:
@@ -90,22 +109,43 @@ async def postgres_url() -> str:
         await drop_database(db_url)
 
 
+@pytest.fixture(scope="session")
+async def postgres_url() -> str:
+    """
+    Creates a temporary database for the whole test session and yield db_url.
+    """
+    async with tmp_database() as db_url:
+        yield db_url
+
+
+@pytest.fixture(scope="module")
+async def migrations_postgres_url() -> str:
+    """
+    Creates an empty temporary database for migrations tests and yield db_url.
+    """
+    async with tmp_database() as db_url:
+        yield db_url
+
+
 @pytest.fixture(scope="module")
-def alembic_config(postgres_url: str) -> Config:
+def alembic_config(migrations_postgres_url: str) -> Config:
     """
     Creates a configuration object for alembic, configured for a temporary database.
     """
-    cmd_options = Namespace(config='cart/alembic.ini', name='alembic', pg_url=postgres_url, raiseerr=False, x=None)
+    cmd_options = Namespace(config='cart/alembic.ini', name='alembic', pg_url=migrations_postgres_url,
+                            raiseerr=False, x=None)
     return make_alembic_config(cmd_options)
 
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 async def pg_engine(postgres_url: str) -> AsyncEngine:
     """
-    Creates tables in db to run the test.
+    Creates tables in db once for the test session.
     Creates and returns an async database engine.
     """
-    engine = create_async_engine(postgres_url)
+    # Tests use one session at a time and the temporary database is local, so connections aren't pinged
+    engine = create_engine(postgres_url, echo=False, pool_size=5, max_overflow=0, pool_recycle=1800,
+                           pool_pre_ping=False, connect_args=TEST_DB_CONNECT_ARGS)
     async with engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
     try:
@@ -114,56 +154,89 @@ async def pg_engine(postgres_url: str) -> AsyncEngine:
         await engine.dispose()
 
 
+@pytest.fixture(scope="session")
+def async_session_factory(pg_engine: AsyncEngine) -> sessionmaker:
+    """
+    Returns the factory of sessions with connection to the database.
+    """
+    return sessionmaker(bind=pg_engine, class_=BaseAsyncSession, expire_on_commit=False)
+
+
 @pytest.fixture
-async def db_session(pg_engine: AsyncEngine) -> BaseAsyncSession:
+async def db_session(async_session_factory: sessionmaker) -> BaseAsyncSession:
     """
     Returns the session with connection to the database.
+    Tables are truncated before each test, the schema itself is created once per test session.
     """
-    AsyncSession = sessionmaker(bind=pg_engine, class_=BaseAsyncSession, expire_on_commit=False)
-    session = AsyncSession()
+    session = async_session_factory()
+    await session.execute(TRUNCATE_TABLES_QUERY)
+    await session.commit()
     try:
         yield session
     finally:
         await session.close()
 
 
-@pytest.fixture
-async def authorized_api_client(db_session, aiohttp_client, aiomisc_unused_port: int, postgres_url: str, event_loop):
+@pytest.fixture(scope="session")
+async def auth_tokens() -> tuple[str, str, int]:
     """
-    Returns API test client and JWT tokens for admin and non-admin from customers service.
+    Creates user in customers service once for the test session.
+    Returns JWT tokens for non-admin and admin and user id.
     """
+    customers_url = f'http://{settings.CUSTOMERS_HOST}:{settings.CUSTOMERS_PORT}/api/v1'
     async with aiohttp.ClientSession() as session:
         # Create user in customer service with is_admin = False
-        user_create_url = f'http://{settings.CUSTOMERS_HOST}:{settings.CUSTOMERS_PORT}/api/v1/users/create/'
         email_passwd = f'cart_user{uuid.uuid4().hex}@email.com'
         user_data = {'email': email_passwd, 'password': email_passwd, 'is_admin': False}
-        async with session.post(url=user_create_url, data=user_data) as response:
-            response_data = await response.json()
+        async with session.post(url=f'{customers_url}/users/create/', data=user_data) as response:
+            response_data = await response.json(loads=orjson.loads)
             user_id = response_data['data']['id']
         # Login as non-admin user, get JWT token
-        user_login_url = f'http://{settings.CUSTOMERS_HOST}:{settings.CUSTOMERS_PORT}/api/v1/auth/login/'
-        async with session.post(url=user_login_url, data=user_data) as response:
-            response_data = await response.json()
+        async with session.post(url=f'{customers_url}/auth/login/', data=user_data) as response:
+            response_data = await response.json(loads=orjson.loads)
             non_admin_jwt_token = response_data['data']['token']
         # Set is_admin to True
         patch_data = {'is_admin': True}
-        users_url = f'http://{settings.CUSTOMERS_HOST}:{settings.CUSTOMERS_PORT}/api/v1/users/{user_id}/'
+        users_url = f'{customers_url}/users/{user_id}/'
         async with session.patch(url=users_url,
                                  data=patch_data,
                                  headers={'Authorization': non_admin_jwt_token}) as response:
-            await response.json()
+            await response.json(loads=orjson.loads)
         # Login as admin user, get JWT token
-        async with session.post(url=user_login_url, data=user_data) as response:
-            response_data = await response.json()
+        async with session.post(url=f'{customers_url}/auth/login/', data=user_data) as response:
+            response_data = await response.json(loads=orjson.loads)
             admin_jwt_token = response_data['data']['token']
 
-    app = create_app(pg_url=postgres_url)
-    client = await aiohttp_client(app, server_kwargs={'port': aiomisc_unused_port})
+        try:
+            yield non_admin_jwt_token, admin_jwt_token, user_id
+        finally:
+            # Delete created user
+            async with session.delete(url=users_url, headers={'Authorization': admin_jwt_token}) as response:
+                await response.json(loads=orjson.loads)
+
+
+@pytest.fixture(scope="session")
+async def api_server(postgres_url: str) -> TestServer:
+    """
+    Returns API test server, the application is started once for the test session.
+    """
+    server = TestServer(create_app(pg_url=postgres_url))
+    await server.start_server()
+    try:
+        yield server
+    finally:
+        await server.close()
+
+
+@pytest.fixture
+async def authorized_api_client(db_session, api_server: TestServer, auth_tokens: tuple[str, str, int]):
+    """
+    Returns API test client and JWT tokens for admin and non-admin from customers service.
+    """
+    non_admin_jwt_token, admin_jwt_token, user_id = auth_tokens
+    client = TestClient(api_server)
     try:
         yield client, non_admin_jwt_token, admin_jwt_token, user_id
     finally:
-        # Delete created user
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(url=users_url, headers={'Authorization': admin_jwt_token}) as response:
-                await response.json()
-        await client.close()
+        # Only client session is closed, the server is shared by all tests
+        await client.session.close()
@@ -5,6 +5,7 @@ Does not require any maintenance - you just add it once to check 80% of typos
 and mistakes in migrations forever.
 """
 from argparse import Namespace
+from functools import lru_cache
 
 import pytest
 from alembic.command import downgrade, upgrade
@@ -14,6 +15,7 @@ from alembic.script import Script, ScriptDirectory
 from cart.utils import make_alembic_config
 
 
+@lru_cache(maxsize=1)
 def get_revisions() -> list:
     # Create Alembic configuration object
     # (we don't need database for getting revisions list)
@@ -29,7 +31,12 @@ def get_revisions() -> list:
     return revisions
 
 
-@pytest.mark.parametrize('revision', get_revisions())
+def pytest_generate_tests(metafunc: pytest.Metafunc):
+    # Revisions are walked only when tests which need them are collected
+    if 'revision' in metafunc.fixturenames:
+        metafunc.parametrize('revision', get_revisions())
+
+
 def test_migrations_stairway(alembic_config: Config, revision: Script):
     upgrade(alembic_config, revision.revision)
 
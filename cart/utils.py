@@ -1,33 +1,58 @@
 import logging
+import re
 from argparse import Namespace
+from collections import defaultdict, deque
 from collections.abc import AsyncIterable
+from functools import lru_cache
 
 from aiohttp.web_urldispatcher import DynamicResource
 from alembic.config import Config
+from sqlalchemy import insert, inspect
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import MANYTOONE, make_transient_to_detached
 from sqlalchemy.sql import Select
 
+from cart.db.models import metadata
+
 
 log = logging.getLogger(__name__)
+# Variable parts of url paths, e.g. `{user_id:\d+}`
+URL_VARIABLE_RE = re.compile(r'\{[^{}]+\}')
 
 
 class SelectQuery(AsyncIterable):
     """
     Used to send data from PostgreSQL to client immediately after receiving,
     without buffering all the data using server side cursor.
+    Rows are fetched from the cursor by batches of `batch_size` rows.
     """
 
-    __slots__ = ('query', 'transaction_ctx')
+    __slots__ = ('query', 'transaction_ctx', 'batch_size')
 
-    def __init__(self, query: Select, transaction_ctx: AsyncConnection):
+    def __init__(self, query: Select, transaction_ctx: AsyncConnection, batch_size: int = 500):
         self.query = query
         self.transaction_ctx = transaction_ctx
+        self.batch_size = batch_size
 
     async def __aiter__(self):
         async with self.transaction_ctx as conn:
             cursor = await conn.stream(self.query)
-            async for row in cursor:
-                yield row
+            async for partition in cursor.partitions(self.batch_size):
+                for row in partition:
+                    yield row
+
+
+class JSONSelectQuery(SelectQuery):
+    """
+    Same as SelectQuery, but for queries which return rows already serialized to JSON by PostgreSQL.
+    """
+
+    __slots__ = ()
+
+    async def __aiter__(self):
+        async for row in super().__aiter__():
+            yield row[0]
 
 
 def get_inner_exception(outer_exception: Exception) -> Exception:
@@ -56,30 +81,88 @@ def fix_white_list_urls(urls: list[str]) -> list[str]:
     """
     Little helper to convert url_path to correct regexp.
     """
-    fixed_urls = []
-    for url in urls:
-        if '{' in url:
-            head, tail = url.split('{')
-            _, tail = tail.split('}')
-            url = fr'{head}.*{tail}'
-        fixed_urls.append(url)
-    return fixed_urls
+    return [URL_VARIABLE_RE.sub('.*', url) for url in urls]
+
+
+@lru_cache(maxsize=256)
+def get_dynamic_resource(path: str) -> DynamicResource:
+    """
+    Returns DynamicResource for the path, its pattern is compiled only once per path.
+    """
+    return DynamicResource(path)
 
 
 def url_for(path: str, **kwargs) -> str:
     """
     Generates URL for dynamic aiohttp route with included.
     """
-    kwargs = {
-        key: str(value)  # All values must be str (for DynamicResource)
-        for key, value in kwargs.items()
-    }
-    return str(DynamicResource(path).url_for(**kwargs))
+    if not all(type(value) is str for value in kwargs.values()):
+        kwargs = {
+            key: str(value)  # All values must be str (for DynamicResource)
+            for key, value in kwargs.items()
+        }
+    return str(get_dynamic_resource(path).url_for(**kwargs))
 
 
 async def add_objects_to_db(objects_list: list, db_session: AsyncSession) -> None:
     """
-    Dirty hack to save objects to database via AsyncSession.
+    Saves objects to database via AsyncSession with one multi-row INSERT per table.
+    Not saved yet related objects (e.g. created by SubFactory) are saved too.
+    Saved objects are attached to the session as persistent ones.
+    """
+    # Collect new objects and their new related objects by tables
+    new_objects = defaultdict(list)
+    objects_to_check, checked_ids = deque(objects_list), set()
+    while objects_to_check:
+        obj = objects_to_check.popleft()
+        state = inspect(obj)
+        if id(obj) in checked_ids or not (state.transient or state.pending):
+            continue
+        checked_ids.add(id(obj))
+        if state.pending:  # added to session by backref cascade, will be inserted here
+            db_session.expunge(obj)
+        new_objects[state.mapper.local_table].append(obj)
+        objects_to_check.extend(related for relationship in state.mapper.relationships
+                                if relationship.direction is MANYTOONE
+                                and (related := state.dict.get(relationship.key)) is not None)
+
+    # Insert objects in order of tables dependencies
+    saved_objects = []
+    for table in (table for table in metadata.sorted_tables if table in new_objects):
+        groups = defaultdict(list)
+        columns = new_objects[table][0]._insert_cols()
+        for obj in new_objects[table]:
+            state = inspect(obj)
+            # Set foreign keys from the related objects, which are already saved
+            for relationship in state.mapper.relationships:
+                if relationship.direction is MANYTOONE and (related := state.dict.get(relationship.key)) is not None:
+                    for local_column, remote_column in relationship.local_remote_pairs:
+                        setattr(obj, local_column.key, getattr(related, remote_column.key))
+            values = {column.key: state.dict[column.key] for column in columns if column.key in state.dict}
+            # Multi-row INSERT takes columns list from the first row, so rows are grouped by columns
+            groups[frozenset(values)].append((obj, values))
+
+        for group in groups.values():
+            insert_query = insert(table).values([values for _, values in group]).returning(*columns)
+            result = await db_session.execute(insert_query)
+            for (obj, _), row in zip(group, result):
+                for column in columns:
+                    setattr(obj, column.key, row._mapping[column])
+                make_transient_to_detached(obj)
+                saved_objects.append(obj)
+    # Objects are attached at the end, otherwise session's cascades would make not inserted related objects pending
+    db_session.add_all(saved_objects)
+    await db_session.commit()
+
+
+async def bulk_insert(model: type, rows: list[dict], db_session: AsyncSession) -> list[Row]:
+    """
+    Saves rows to database table of the model with one multi-row INSERT.
+    Returns inserted rows, including generated values, in the same order.
+    Use `add_objects_to_db` for objects with relationships.
     """
-    db_session.add_all(objects_list)
+    table = model.__table__
+    result = await db_session.execute(insert(table).values(rows).returning(*table.columns))
+    inserted_rows = result.all()
     await db_session.commit()
+    return inserted_rows
@@ -1,6 +1,9 @@
 import asyncio
 import logging
-from functools import partial
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, partial
 from types import AsyncGeneratorType, MappingProxyType
 from typing import AsyncIterable, Mapping
 
@@ -8,23 +11,28 @@ from aiohttp import PAYLOAD_REGISTRY
 from aiohttp.web_app import Application
 from aiohttp_apispec import validation_middleware, AiohttpApiSpec
 from aiohttp_jwt import JWTMiddleware
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine
 
 from customers import settings
 from customers.api import API_VIEWS, JWT_WHITE_LIST
-from customers.api.middleware import error_middleware
-from customers.api.payloads import AsyncGenJSONListPayload, JsonPayload
+from customers.api.middleware import cached_jwt_middleware, error_middleware
+from customers.api.payloads import AsyncGenJSONListPayload, JsonPayload, PreserializedAsyncGenJSONListPayload
+from customers.db.engine import create_engine, warm_up_pool
 from customers.rpc.server import GRPCServer
-from customers.utils import is_jwt_token_revoked, fix_white_list_urls
+from customers.utils import is_jwt_token_revoked, fix_white_list_urls, JSONSelectQuery
 
 
 log = logging.getLogger(__name__)
-docs_path = '/api/v1/docs/'
-jwt_middleware = JWTMiddleware(secret_or_pub_key=settings.JWT_SECRET,
-                               whitelist=[f'{docs_path}.*'] + fix_white_list_urls(JWT_WHITE_LIST),
-                               algorithms=settings.JWT_ALGORITHMS,
-                               is_revoked=is_jwt_token_revoked)
+# All whitelisted url patterns are joined into a single regexp, compiled once
+jwt_whitelist_re = re.compile('|'.join(
+    f'(?:{pattern})' for pattern in [f'{settings.DOCS_PATH}.*', *fix_white_list_urls(JWT_WHITE_LIST)]
+))
+# Whitelisted paths without variable parts are found by set lookup, without regexp matching
+jwt_whitelist_paths = frozenset(path for path in JWT_WHITE_LIST if '{' not in path)
+jwt_middleware = cached_jwt_middleware(JWTMiddleware(secret_or_pub_key=settings.JWT_SECRET,
+                                                     whitelist=[jwt_whitelist_re.pattern],
+                                                     algorithms=settings.JWT_ALGORITHMS,
+                                                     is_revoked=is_jwt_token_revoked),
+                                       whitelist_re=jwt_whitelist_re, whitelist_paths=jwt_whitelist_paths)
 
 
 async def setup_db(app: Application, pg_url: str | None = None):
@@ -32,9 +40,13 @@ async def setup_db(app: Application, pg_url: str | None = None):
     Initiate connection to database on startup and close it on cleanup
     """
     log.info(f'Connecting to database: {settings.DB_INFO}')
-    engine = create_async_engine(pg_url or settings.DB_URL, echo=settings.DEBUG)
-    async with engine.connect() as conn:
-        await conn.execute(text('Select 1;'))
+    engine = create_engine(pg_url)
+    try:
+        await warm_up_pool(engine)
+    except BaseException:
+        # Pool connections opened before the failure are closed
+        await engine.dispose()
+        raise
     app['engine'] = engine
     log.info(f'Connected to database: {settings.DB_INFO}')
 
@@ -47,11 +59,31 @@ async def setup_db(app: Application, pg_url: str | None = None):
         log.info(f'Disconnected from database: {settings.DB_INFO}')
 
 
+async def setup_hash_pool(app: Application):
+    """
+    Creates processes pool for passwords hashing on startup and shutdown it on cleanup.
+    Hashing is CPU-bound, so it would block the event loop and wouldn't run in parallel in threads.
+    Workers are started by the forkserver, because forking the process with running gRPC threads is unsafe.
+    """
+    app['hash_pool'] = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS,
+                                           mp_context=multiprocessing.get_context('forkserver'))
+    log.info('Started password hashing pool.')
+
+    try:
+        yield
+
+    finally:
+        # Pending hashing jobs are cancelled, so the event loop is not blocked until they're done
+        app['hash_pool'].shutdown(wait=False, cancel_futures=True)
+        log.info('Stopped password hashing pool.')
+
+
 async def setup_grpc_server(app: Application):
     """
     Initiate and start gRPC server on startup and stop it on cleanup
     """
-    server = GRPCServer()
+    # The server shares the database engine, so it's set up after database (see `setup_db`)
+    server = GRPCServer(engine=app['engine'])
     grpc_task = asyncio.ensure_future(server.start())
     log.info('Started gRPC server.')
 
@@ -65,6 +97,17 @@ async def setup_grpc_server(app: Application):
         log.info('Stopped gRPC server.')
 
 
+@cache
+def register_payloads():
+    """
+    Registers payloads in the global aiohttp registry only once,
+    otherwise each created application would make payloads lookups longer.
+    """
+    PAYLOAD_REGISTRY.register(PreserializedAsyncGenJSONListPayload, JSONSelectQuery)
+    PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload, (AsyncGeneratorType, AsyncIterable))
+    PAYLOAD_REGISTRY.register(JsonPayload, (Mapping, MappingProxyType))
+
+
 def create_app(pg_url: str | None = None) -> Application:
     """
     Creates an instance of the application, ready to run.
@@ -74,6 +117,9 @@ def create_app(pg_url: str | None = None) -> Application:
     # Connect to postgres at start and disconnect at stop
     app.cleanup_ctx.append(partial(setup_db, pg_url=pg_url))
 
+    # Create password hashing pool at start and shutdown it at stop
+    app.cleanup_ctx.append(setup_hash_pool)
+
     # Start gRPC server at start and shutdown at stop
     app.cleanup_ctx.append(setup_grpc_server)
 
@@ -84,13 +130,13 @@ def create_app(pg_url: str | None = None) -> Application:
 
     # Swagger documentation
     api_spec = AiohttpApiSpec(app=app, title='Customers Service API', version='v1', request_data_name='validated_data',
-                              swagger_path=docs_path, url=f'{docs_path}swagger.json', static_path=f'{docs_path}static')
+                              swagger_path=settings.DOCS_PATH, url=f'{settings.DOCS_PATH}swagger.json',
+                              static_path=f'{settings.DOCS_PATH}static')
     # Manual add Authorize header to swagger
     api_key_scheme = {"type": "apiKey", "in": "header", "name": "Authorization"}
     api_spec.spec.components.security_scheme('JWT Authorization', api_key_scheme)
 
     # Automatic json serialization of data in HTTP responses
-    PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload, (AsyncGeneratorType, AsyncIterable))
-    PAYLOAD_REGISTRY.register(JsonPayload, (Mapping, MappingProxyType))
+    register_payloads()
 
     return app
@@ -1,19 +1,26 @@
-import json
+import hashlib
 import logging
+import re
+import time
+from functools import partial
 from http import HTTPStatus
 from typing import Mapping
 
+import orjson
 from aiohttp.web_exceptions import HTTPException
 from aiohttp.web_middlewares import middleware
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
 from marshmallow import ValidationError
 
+from customers import settings
 from customers.api.payloads import JsonPayload
 
 
 log = logging.getLogger(__name__)
 VALIDATION_ERROR_DESCRIPTION = 'Request validation has failed'
+# Decoded tokens payloads: {token hash: (expiration monotonic time, payload)}
+TOKEN_CACHE: dict[bytes, tuple[float, dict]] = {}
 
 
 def format_http_error(message: str | None = '', status_code: int = HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -27,7 +34,7 @@ def format_http_error(message: str | None = '', status_code: int = HTTPStatus.IN
     # Adds field errors which failed marshmallow validation
     if '{' in message:
         error['message'] = VALIDATION_ERROR_DESCRIPTION
-        error['fields'] = json.loads(message)
+        error['fields'] = orjson.loads(message)
     # Other errors
     else:
         error['message'] = message or status.description
@@ -47,6 +54,71 @@ def handle_validation_error(error: ValidationError):
                              fields=error.messages)
 
 
+def get_token_cache_key(jwt_token: str) -> bytes:
+    """
+    Hashes the token, so raw tokens are not kept in memory.
+    """
+    return hashlib.blake2b(jwt_token.encode(), digest_size=16).digest()
+
+
+def get_cached_token_payload(token_key: bytes) -> dict | None:
+    """
+    Returns cached payload of the decoded token if it's not expired yet.
+    """
+    if (cached := TOKEN_CACHE.get(token_key)) is not None:
+        expires_at, payload = cached
+        if expires_at > time.monotonic():
+            return payload
+        del TOKEN_CACHE[token_key]
+    return None
+
+
+def cache_token_payload(token_key: bytes, payload: dict) -> None:
+    """
+    Stores the decoded token payload, but not longer than the token itself is valid.
+    Drops the oldest 10% of entries if the cache is full.
+    """
+    if len(TOKEN_CACHE) >= settings.JWT_CACHE_MAX_SIZE:
+        for key in list(TOKEN_CACHE)[:settings.JWT_CACHE_MAX_SIZE // 10 or 1]:
+            del TOKEN_CACHE[key]
+    ttl = min(settings.JWT_CACHE_TTL, payload['exp'] - time.time()) if 'exp' in payload else settings.JWT_CACHE_TTL
+    TOKEN_CACHE[token_key] = (time.monotonic() + ttl, payload)
+
+
+def revoke_cached_tokens(user_id: int) -> None:
+    """
+    Drops cached payloads of the user's tokens, e.g. when the user is deleted.
+    """
+    for key in [key for key, (_, payload) in TOKEN_CACHE.items() if payload.get('id') == user_id]:
+        del TOKEN_CACHE[key]
+
+
+def cached_jwt_middleware(jwt_middleware, whitelist_re: re.Pattern, whitelist_paths: frozenset[str] = frozenset()):
+    """
+    Wraps aiohttp_jwt middleware: tokens which were decoded and checked recently are not decoded and checked again.
+    Whitelisted requests are passed to the handler right away, the same as aiohttp_jwt does,
+    but with a set lookup and a single compiled regexp instead of matching each whitelist pattern.
+    """
+    async def cache_payload(request: Request, handler, token_key: bytes):
+        if (payload := request.get('payload')) is not None:
+            cache_token_payload(token_key, payload)
+        return await handler(request)
+
+    @middleware
+    async def jwt_cache_middleware(request: Request, handler):
+        if request.path in whitelist_paths or whitelist_re.match(request.path) is not None:
+            return await handler(request)
+        if not (jwt_token := request.headers.get('Authorization')):
+            return await jwt_middleware(request, handler)
+        token_key = get_token_cache_key(jwt_token)
+        if (payload := get_cached_token_payload(token_key)) is not None:
+            request['payload'] = payload
+            return await handler(request)
+        return await jwt_middleware(request, partial(cache_payload, handler=handler, token_key=token_key))
+
+    return jwt_cache_middleware
+
+
 @middleware
 async def error_middleware(request: Request, handler):
     try:
@@ -3,32 +3,49 @@ from typing import NoReturn
 from aiohttp.web_exceptions import HTTPNotFound, HTTPForbidden
 from aiohttp.web_response import StreamResponse
 
-from sqlalchemy import exists, select, Table
+from sqlalchemy import bindparam, exists, select, Table
+from sqlalchemy.sql import Select
 
 
 class CheckObjectExistsMixin:
+    """
+    Object existence is not checked in advance: views get it from their own queries.
+    It's checked only before access denial, so requests to not existent objects get 404 response.
+    """
     object_id_path: str
     check_exists_table: Table
+    check_exists_query: Select
 
-    async def _iter(self) -> StreamResponse:
-        await self.check_object_exists()
-        return await super()._iter()
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The query is built once per view class, only object id is passed on each request
+        if (table := getattr(cls, 'check_exists_table', None)) is not None:
+            cls.check_exists_query = select(exists().where(table.c.id == bindparam('object_id')))
 
     @property
     def object_id(self) -> int:
         return int(self.request.match_info.get(self.object_id_path))
 
     async def check_object_exists(self) -> NoReturn:
-        query = select(exists().where(self.check_exists_table.c.id == self.object_id))
         async with self.engine.connect() as conn:
-            result = await conn.execute(query)
+            result = await conn.execute(self.check_exists_query, {'object_id': self.object_id})
         if not result.scalar():
             raise HTTPNotFound()
 
+    async def permission_denied(self) -> NoReturn:
+        await self.check_object_exists()
+        await super().permission_denied()
+
 
 class CheckUserPermissionMixin:
     skip_methods: list = []
     permissions_classes: list = []
+    permissions_objects: tuple = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Permissions are stateless, so they are instantiated once per view class
+        cls.permissions_objects = tuple(permission() for permission in cls.permissions_classes)
 
     async def _iter(self) -> StreamResponse:
         if self.request.method not in self.skip_methods:
@@ -36,7 +53,9 @@ class CheckUserPermissionMixin:
         return await super()._iter()
 
     async def check_permissions(self) -> NoReturn:
-        permissions_objects = [permission() for permission in self.permissions_classes]
-        for permission in permissions_objects:
+        for permission in self.permissions_objects:
             if not permission.has_permission(self.request, self):
-                raise HTTPForbidden(reason='You do not have permission to perform this action.')
+                await self.permission_denied()
+
+    async def permission_denied(self) -> NoReturn:
+        raise HTTPForbidden(reason='You do not have permission to perform this action.')
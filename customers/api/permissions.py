@@ -26,4 +26,5 @@ class IsAuthenticatedForObject(BasePermission):
         """
         Return `True` if permission is granted or `user.is_admin == True`, `False` otherwise.
         """
-        return (request['payload'].get('id') == view.object_id) or request['payload'].get('is_admin', False)
+        payload = request['payload']
+        return (payload.get('id') == view.object_id) or payload.get('is_admin', False)
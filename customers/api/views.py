@@ -1,23 +1,49 @@
+import asyncio
+import uuid
 from http import HTTPStatus
 
 from aiohttp import hdrs
+from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response
 from aiohttp.web_urldispatcher import View
 from aiohttp_apispec import docs, request_schema, response_schema
 from asyncpg import UniqueViolationError
 from marshmallow import ValidationError
-from sqlalchemy import select, or_, text
+from sqlalchemy import bindparam, select, or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 from customers.api import schema, mixins
+from customers.api.middleware import revoke_cached_tokens
 from customers.api.permissions import IsAuthenticatedForObject
-from customers.db.models import User, users_t, MAIN_USER_QUERY, MAIN_USER_COLS
-from customers.utils import get_jwt_token_for_user, get_inner_exception, SelectQuery
+from customers.db.models import User, users_t, MAIN_USER_QUERY, MAIN_USER_COLS, USERS_JSON_QUERY
+from customers.utils import get_jwt_token_for_user, get_inner_exception, JSONSelectQuery, cache_user_tokens_revoked
 
 
 # swagger security schema
 jwt_security = [{'JWT Authorization': []}]
+# Responses schemas are used for documentation, responses are built as plain dicts and serialized by orjson
+JWT_TOKEN_RESPONSE_SCHEMA = schema.JWTTokenResponseSchema()
+USER_DETAILS_RESPONSE_SCHEMA = schema.UserDetailsResponseSchema()
+# User's fields in responses (without password)
+USER_RESPONSE_FIELDS = tuple(column.key for column in MAIN_USER_COLS)
+# Invariant queries are built once, their parameters are bound on execution
+USER_BY_EMAIL_QUERY = select(users_t).where(users_t.c.email == bindparam('email'))
+# Password for not existent user is checked against it, so login takes the same time whether the user exists or not
+DUMMY_PASSWORD_HASH = User.make_user_password_hash(uuid.uuid4().hex)
+USERS_SEARCH_QUERY = USERS_JSON_QUERY.where(or_(users_t.c.email.ilike(bindparam('search_pattern')),
+                                                users_t.c.first_name.ilike(bindparam('search_pattern')),
+                                                users_t.c.last_name.ilike(bindparam('search_pattern'))))
+USER_QUERY = MAIN_USER_QUERY.where(users_t.c.id == bindparam('user_id'))
+# Inserted columns are taken from the parameters, the statement is compiled once for each set of them
+USER_INSERT_QUERY = users_t.insert().returning(*MAIN_USER_COLS)
+USER_DELETE_QUERY = users_t.delete().where(users_t.c.id == bindparam('user_id')).returning(users_t.c.id)
+USER_PASSWORD_UPDATE_QUERY = (users_t.update().values(password=bindparam('password'))
+                              .where(users_t.c.id == bindparam('user_id')).returning(users_t.c.id))
+# Rehash on login doesn't overwrite the password if it was changed concurrently
+USER_PASSWORD_REHASH_QUERY = (users_t.update().values(password=bindparam('password'))
+                              .where(users_t.c.id == bindparam('user_id'),
+                                     users_t.c.password == bindparam('old_password')))
 
 
 class BaseView(View):
@@ -27,6 +53,15 @@ class BaseView(View):
     def engine(self) -> AsyncEngine:
         return self.request.app['engine']
 
+    async def make_password_hash(self, raw_password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.request.app['hash_pool'], User.make_user_password_hash, raw_password)
+
+    async def check_password(self, raw_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.request.app['hash_pool'], User.check_user_password_and_update,
+                                          raw_password, hashed_password)
+
 
 class LoginAPIView(BaseView):
     """
@@ -38,20 +73,26 @@ class LoginAPIView(BaseView):
           summary='Login',
           description='Login user to system')
     @request_schema(schema.UserSchema(only=('email', 'password')))
-    @response_schema(schema.JWTTokenResponseSchema(), code=HTTPStatus.OK.value)
+    @response_schema(JWT_TOKEN_RESPONSE_SCHEMA, code=HTTPStatus.OK.value)
     async def post(self):
         validated_data = self.request['validated_data']
-        get_user_query = select(users_t).where(users_t.c.email == validated_data['email'])
         async with self.engine.connect() as conn:
-            user_result = await conn.execute(get_user_query)
-        if (user := user_result.first()) is not None:
-            if User.check_user_password(validated_data['password'], user.password):
-                response_data = {
-                    'token': f'Bearer {get_jwt_token_for_user(user=user)}',
-                    'user': user
-                }
-                return Response(body=schema.JWTTokenResponseSchema().dump({'data': response_data}),
-                                status=HTTPStatus.OK)
+            user_result = await conn.execute(USER_BY_EMAIL_QUERY, {'email': validated_data['email']})
+        user = user_result.first()
+        # Password is always checked, there's one hashing per login attempt
+        password_hash = user.password if user is not None else DUMMY_PASSWORD_HASH
+        is_valid, new_password_hash = await self.check_password(validated_data['password'], password_hash)
+        if is_valid and user is not None:
+            if new_password_hash is not None:
+                # Password hashed with deprecated scheme is replaced with the current one
+                async with self.engine.begin() as conn:
+                    await conn.execute(USER_PASSWORD_REHASH_QUERY, {'password': new_password_hash, 'user_id': user.id,
+                                                                    'old_password': password_hash})
+            response_data = {
+                'token': f'Bearer {get_jwt_token_for_user(user=user)}',
+                'user': {field: user._mapping[field] for field in USER_RESPONSE_FIELDS}
+            }
+            return Response(body={'data': response_data}, status=HTTPStatus.OK)
         raise ValidationError({'non_field_errors': ['Unable to log in with provided credentials.']})
 
 
@@ -65,16 +106,16 @@ class UserCreateAPIView(BaseView):
           summary='Create new user',
           description='Add new user to database')
     @request_schema(schema.UserSchema(exclude=('id', 'created')))
-    @response_schema(schema.UserDetailsResponseSchema(), code=HTTPStatus.CREATED.value)
+    @response_schema(USER_DETAILS_RESPONSE_SCHEMA, code=HTTPStatus.CREATED.value)
     async def post(self):
+        validated_data = self.request['validated_data']
+        # Password is hashed before the connection is acquired, so the connection isn't held while hashing
+        validated_data['password'] = await self.make_password_hash(validated_data['password'])
         # The transaction is required in order to roll back partially added changes in case of an error
         # (or disconnection of the client without waiting for a response).
         async with self.engine.begin() as conn:
-            validated_data = self.request['validated_data']
-            validated_data['password'] = User.make_user_password_hash(validated_data['password'])
-            insert_user_query = users_t.insert().returning(*MAIN_USER_COLS).values(validated_data)
             try:
-                new_user_result = await conn.execute(insert_user_query)
+                new_user_result = await conn.execute(USER_INSERT_QUERY, validated_data)
             except IntegrityError as err:
                 if (inner_exc := get_inner_exception(err)) and isinstance(inner_exc, UniqueViolationError):
                     field = inner_exc.constraint_name.split('__')[-1]
@@ -82,8 +123,7 @@ class UserCreateAPIView(BaseView):
                 else:  # pragma: no cover
                     raise ValidationError({'non_field_errors': ['Failed to create user with provided data.']})
             response_data = new_user_result.first()
-        return Response(body=schema.UserDetailsResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.CREATED)
+        return Response(body={'data': response_data}, status=HTTPStatus.CREATED)
 
 
 class UsersListAPIView(mixins.CheckUserPermissionMixin, BaseView):
@@ -108,12 +148,11 @@ class UsersListAPIView(mixins.CheckUserPermissionMixin, BaseView):
           }])
     @response_schema(schema.UserListResponseSchema(), code=HTTPStatus.OK.value)
     async def get(self):
-        users_query = MAIN_USER_QUERY
         if search_term := self.request.query.get('search'):
-            users_query = users_query.where(or_(users_t.c.email.ilike(f'%{search_term}%'),
-                                                users_t.c.first_name.ilike(f'%{search_term}%'),
-                                                users_t.c.last_name.ilike(f'%{search_term}%')))
-        body = SelectQuery(query=users_query, transaction_ctx=self.engine.begin())
+            body = JSONSelectQuery(query=USERS_SEARCH_QUERY, transaction_ctx=self.engine.begin(),
+                                   parameters={'search_pattern': f'%{search_term}%'})
+        else:
+            body = JSONSelectQuery(query=USERS_JSON_QUERY, transaction_ctx=self.engine.begin())
         return Response(body=body, status=HTTPStatus.OK)
 
 
@@ -128,48 +167,45 @@ class UserRetrieveUpdateDestroyAPIView(mixins.CheckObjectExistsMixin, mixins.Che
     permissions_classes = [IsAuthenticatedForObject]
 
     async def get_user(self):
-        user_query = MAIN_USER_QUERY.where(users_t.c.id == self.object_id)
         async with self.engine.connect() as conn:
-            user_result = await conn.execute(user_query)
-        return user_result.first()
+            user_result = await conn.execute(USER_QUERY, {'user_id': self.object_id})
+        if (user := user_result.first()) is None:
+            raise HTTPNotFound()
+        return user
 
     @docs(tags=['users'],
           summary='Retrieve user',
           description='Returns information for a user',
           security=jwt_security)
-    @response_schema(schema.UserDetailsResponseSchema(), code=HTTPStatus.OK.value)
+    @response_schema(USER_DETAILS_RESPONSE_SCHEMA, code=HTTPStatus.OK.value)
     async def get(self):
         response_data = await self.get_user()
-        return Response(body=schema.UserDetailsResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.OK)
+        return Response(body={'data': response_data}, status=HTTPStatus.OK)
 
     @docs(tags=['users'],
           summary='Update user',
           description='Updates information for a user',
           security=jwt_security)
     @request_schema(schema.UserPatchSchema())
-    @response_schema(schema.UserDetailsResponseSchema(), code=HTTPStatus.OK.value)
+    @response_schema(USER_DETAILS_RESPONSE_SCHEMA, code=HTTPStatus.OK.value)
     async def patch(self):
         async with self.engine.begin() as conn:
             validated_data = self.request['validated_data']
-
-            # Blocking will avoid race conditions between concurrent user change requests
-            await conn.execute(text('SELECT pg_advisory_xact_lock(:lid)').bindparams(lid=self.object_id))
-
-            patch_query = users_t.update().values(validated_data).where(users_t.c.id == self.object_id)
+            # Single UPDATE locks the user's row, checks its existence and returns up-to-date information
+            patch_query = users_t.update().values(validated_data).where(users_t.c.id == self.object_id) \
+                .returning(*MAIN_USER_COLS)
             try:
-                await conn.execute(patch_query)
+                patch_result = await conn.execute(patch_query)
             except IntegrityError as err:
                 if (inner_exc := get_inner_exception(err)) and isinstance(inner_exc, UniqueViolationError):
                     field = inner_exc.constraint_name.split('__')[-1]
                     raise ValidationError({f"{field}": [f"User with this {field} already exists."]})
                 else:  # pragma: no cover
                     raise ValidationError({'non_field_errors': ['Failed to update user with provided data.']})
+            if (response_data := patch_result.first()) is None:
+                raise HTTPNotFound()
 
-        # Get up-to-date information about the user
-        response_data = await self.get_user()
-        return Response(body=schema.UserDetailsResponseSchema().dump({'data': response_data}),
-                        status=HTTPStatus.OK)
+        return Response(body={'data': response_data}, status=HTTPStatus.OK)
 
     @docs(tags=['users'],
           summary='Delete user',
@@ -177,9 +213,13 @@ class UserRetrieveUpdateDestroyAPIView(mixins.CheckObjectExistsMixin, mixins.Che
           security=jwt_security)
     @response_schema(schema.NoContentResponseSchema(), code=HTTPStatus.NO_CONTENT.value)
     async def delete(self):
-        delete_query = users_t.delete().where(users_t.c.id == self.object_id)
         async with self.engine.begin() as conn:
-            await conn.execute(delete_query)
+            delete_result = await conn.execute(USER_DELETE_QUERY, {'user_id': self.object_id})
+        if delete_result.first() is None:
+            raise HTTPNotFound()
+        # Tokens of the deleted user are revoked
+        revoke_cached_tokens(self.object_id)
+        cache_user_tokens_revoked(self.object_id, revoked=True)
         return Response(body={}, status=HTTPStatus.NO_CONTENT)
 
 
@@ -199,13 +239,12 @@ class UserChangePasswordAPIView(mixins.CheckObjectExistsMixin, mixins.CheckUserP
     @request_schema(schema.UserChangePasswordSchema())
     @response_schema(schema.NoContentResponseSchema(), code=HTTPStatus.OK.value)
     async def patch(self):
+        validated_data = self.request['validated_data']
+        new_password_hash = await self.make_password_hash(validated_data['new_password'])
         async with self.engine.begin() as conn:
-            validated_data = self.request['validated_data']
-            new_password_hash = User.make_user_password_hash(validated_data['new_password'])
-
-            # Blocking will avoid race conditions between concurrent user change requests
-            await conn.execute(text('SELECT pg_advisory_xact_lock(:lid)').bindparams(lid=self.object_id))
-
-            patch_query = users_t.update().values(password=new_password_hash).where(users_t.c.id == self.object_id)
-            await conn.execute(patch_query)
+            # Single UPDATE locks the user's row and checks its existence
+            patch_result = await conn.execute(USER_PASSWORD_UPDATE_QUERY,
+                                              {'password': new_password_hash, 'user_id': self.object_id})
+            if patch_result.first() is None:
+                raise HTTPNotFound()
         return Response(body={}, status=HTTPStatus.OK)
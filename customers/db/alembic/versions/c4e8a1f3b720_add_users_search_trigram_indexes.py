@@ -0,0 +1,33 @@
+"""Add users search trigram indexes
+
+Revision ID: c4e8a1f3b720
+Revises: ed7855b80d3fdata
+Create Date: 2026-10-15 16:42:18.537104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f3b720'
+down_revision = 'ed7855b80d3fdata'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(op.f('ix__users__email'), 'users', ['email'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'email': 'gin_trgm_ops'})
+    op.create_index(op.f('ix__users__first_name'), 'users', ['first_name'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'first_name': 'gin_trgm_ops'})
+    op.create_index(op.f('ix__users__last_name'), 'users', ['last_name'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'last_name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index(op.f('ix__users__last_name'), table_name='users')
+    op.drop_index(op.f('ix__users__first_name'), table_name='users')
+    op.drop_index(op.f('ix__users__email'), table_name='users')
+    op.execute('DROP EXTENSION IF EXISTS pg_trgm')
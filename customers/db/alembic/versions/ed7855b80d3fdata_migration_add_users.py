@@ -5,12 +5,13 @@ Revises: 274d2f4e6ee7
 Create Date: 2022-02-18 16:04:49.514623
 
 """
+import factory
 from alembic import op
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 
 from customers.db.factories import UserFactory
-from customers.db.models import User
+from customers.db.models import User, users_t
 
 
 # revision identifiers, used by Alembic.
@@ -24,18 +25,16 @@ NON_ADMIN_EMAILS = ['nonadmin3@email.com', 'nonadmin4@email.com']
 
 
 def upgrade():
-    # Create users objects and add them to the list
-    users_list = []
-    users_list.extend(
-        (UserFactory(id=id_, email=email, is_admin=True) for id_, email in enumerate(ADMIN_EMAILS, start=1))
-    )
-    users_list.extend(
-        (UserFactory(id=id_, email=email) for id_, email in enumerate(NON_ADMIN_EMAILS, start=3))
-    )
-    # Add users from list to db
+    # Create users rows, password is hashed once for all of them (see `UserFactory`)
+    users_emails = [(email, True) for email in ADMIN_EMAILS] + [(email, False) for email in NON_ADMIN_EMAILS]
+    users_rows = [
+        factory.build(dict, FACTORY_CLASS=UserFactory, id=id_, email=email, is_admin=is_admin)
+        for id_, (email, is_admin) in enumerate(users_emails, start=1)
+    ]
+    # Add users to db with a single multi-row INSERT
     with sessionmaker(bind=op.get_bind())() as session:
         with session.begin():
-            session.add_all(users_list)
+            session.execute(users_t.insert().values(users_rows))
             session.execute(text('ALTER SEQUENCE users_id_seq RESTART WITH 5;'))
 
 
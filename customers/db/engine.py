@@ -0,0 +1,42 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from customers import settings
+
+
+def create_engine(pg_url: str | None = None, **kwargs) -> AsyncEngine:
+    """
+    Creates an async database engine with a connection pool configured by settings.
+    Any engine option can be overridden with kwargs.
+    """
+    options = {
+        'echo': settings.DEBUG,
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+        'query_cache_size': settings.DB_QUERY_CACHE_SIZE,
+        'connect_args': {'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+                         'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE},
+    }
+    options.update(kwargs)
+    return create_async_engine(pg_url or settings.DB_URL, **options)
+
+
+async def warm_up_pool(engine: AsyncEngine, size: int = settings.DB_POOL_SIZE) -> None:
+    """
+    Opens `size` pool connections concurrently and returns them to the pool,
+    so requests don't have to wait for new connections after startup.
+    Opening fails if database is unavailable, so no query is run on the connections.
+    Opened connections are returned to the pool even if some of them failed, then the first error is raised.
+    """
+    # All connections are checked out at the same time, otherwise the pool would reuse the first one
+    results = await asyncio.gather(*(engine.connect().start() for _ in range(size)), return_exceptions=True)
+    await asyncio.gather(*(conn.close() for conn in results if not isinstance(conn, BaseException)))
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
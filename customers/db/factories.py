@@ -1,3 +1,5 @@
+from functools import cache
+
 import factory
 
 from customers.db.models import User
@@ -6,6 +8,14 @@ from customers.db.models import User
 USER_TEST_PASSWORD = 'testPass123'
 
 
+@cache
+def get_test_password_hash() -> str:
+    """
+    Hash of the test password, which is computed once, since hashing is slow by design.
+    """
+    return User.make_user_password_hash(USER_TEST_PASSWORD)
+
+
 class UserFactory(factory.alchemy.SQLAlchemyModelFactory):
 
     class Meta:
@@ -17,7 +27,7 @@ class UserFactory(factory.alchemy.SQLAlchemyModelFactory):
 
     @factory.lazy_attribute
     def password(self):
-        return User.make_user_password_hash(USER_TEST_PASSWORD)
+        return get_test_password_hash()
 
     @factory.lazy_attribute
     def email(self):
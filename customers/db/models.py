@@ -1,5 +1,6 @@
-from passlib.hash import sha256_crypt
-from sqlalchemy import Column, Integer, MetaData, String, DateTime, Boolean, select
+from passlib.context import CryptContext
+from sqlalchemy import DDL, Column, Integer, Index, MetaData, String, DateTime, Boolean, Text, bindparam, cast, event, \
+    exists, func, literal_column, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy.sql.expression import text
@@ -19,8 +20,14 @@ convention = {
     'pk': 'pk__%(table_name)s'
 }
 
+# New passwords are hashed with scrypt of hashlib (OpenSSL implementation).
+# Passwords hashed with deprecated sha256_crypt are still verified and rehashed on login.
+PASSWORD_CONTEXT = CryptContext(schemes=['scrypt', 'sha256_crypt'], deprecated='auto')
+
 # Registry for all tables
 metadata = MetaData(naming_convention=convention)
+# Trigram indexes (see `User`) require pg_trgm extension
+event.listen(metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
 
 
 @as_declarative(metadata=metadata)
@@ -52,19 +59,34 @@ class User(Base):
     password = Column(String, nullable=False)
     is_admin = Column(Boolean, nullable=False, default=False)
 
+    __table_args__ = (
+        # Trigram indexes allow users search by substring (ILIKE '%term%') without sequential scan
+        Index(None, 'email', postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'}),
+        Index(None, 'first_name', postgresql_using='gin', postgresql_ops={'first_name': 'gin_trgm_ops'}),
+        Index(None, 'last_name', postgresql_using='gin', postgresql_ops={'last_name': 'gin_trgm_ops'}),
+    )
+
     @staticmethod
     def make_user_password_hash(raw_password: str) -> str:
         """
         Turn a plain-text password into a hash for database storage.
         """
-        return sha256_crypt.hash(raw_password)
+        return PASSWORD_CONTEXT.hash(raw_password)
 
     @staticmethod
     def check_user_password(raw_password: str, hashed_password: str) -> bool:
         """
         Return a boolean of whether the raw_password was correct.
         """
-        return sha256_crypt.verify(raw_password, hashed_password)
+        return PASSWORD_CONTEXT.verify(raw_password, hashed_password)
+
+    @staticmethod
+    def check_user_password_and_update(raw_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        Return a boolean of whether the raw_password was correct
+        and a new hash if the hashed_password uses deprecated scheme.
+        """
+        return PASSWORD_CONTEXT.verify_and_update(raw_password, hashed_password)
 
 
 # Sql alchemy tables
@@ -74,3 +96,9 @@ users_t = User.__table__
 MAIN_USER_COLS = [users_t.c.id, users_t.c.created, users_t.c.email, users_t.c.first_name, users_t.c.last_name,
                   users_t.c.is_admin]
 MAIN_USER_QUERY = select(MAIN_USER_COLS).order_by(users_t.c.id)
+USER_EXISTS_QUERY = select(exists().where(users_t.c.id == bindparam('user_id')))
+# Users are serialized to JSON by PostgreSQL
+USER_JSON_FIELDS = {column.key: column for column in MAIN_USER_COLS}
+USERS_JSON_QUERY = select(cast(func.json_build_object(*(
+    arg for key, column in USER_JSON_FIELDS.items() for arg in (literal_column(f"'{key}'"), column)
+)), Text)).order_by(users_t.c.id)
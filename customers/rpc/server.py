@@ -2,16 +2,18 @@ import logging
 
 import grpc
 import jwt
-from sqlalchemy import select, exists
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 from customers import settings
-from customers.db.models import users_t
+from customers.api.middleware import cache_token_payload, get_cached_token_payload, get_token_cache_key
+from customers.utils import check_user_tokens_revoked
 from protobufs.auth_pb2 import Payload, AuthRequest, AuthResponse
 from protobufs.auth_pb2_grpc import UserAuthServicer, add_UserAuthServicer_to_server
 
 
 log = logging.getLogger(__name__)
+# HMAC key is encoded once, not on each token decoding
+JWT_SECRET_KEY = settings.JWT_SECRET.encode()
 
 
 class UserAuthService(UserAuthServicer):  # pragma: no cover because we have integration tests in cart for it
@@ -19,32 +21,38 @@ class UserAuthService(UserAuthServicer):  # pragma: no cover because we have int
     gRPC user auth service, which check user's jwt token.
     """
 
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
     async def ValidateToken(self, request: AuthRequest, context):
         payload = None
-        try:
-            scheme, token = request.token.value.strip().split(' ')
-        except ValueError:
-            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid JWT token')
-        else:
-            if scheme != 'Bearer':
-                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid token scheme')
-            if token:
-                token = token.encode()
-                try:
-                    decoded = jwt.decode(token, settings.JWT_SECRET, algorithms=settings.JWT_ALGORITHMS)
-                except jwt.InvalidTokenError as exc:
-                    log.exception(exc, exc_info=exc)
-                    msg = f'Invalid authorization token, {exc}'
-                    await context.abort(grpc.StatusCode.INVALID_ARGUMENT, msg)
-                else:
-                    user_id = decoded['id']
-                    query = select(exists().where(users_t.c.id == user_id))
-                    engine = create_async_engine(settings.DB_URL)
-                    async with engine.connect() as conn:
-                        result = await conn.execute(query)
-                    if not result.scalar():
-                        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Token is revoked')
-                    payload = Payload(user_id=user_id, email=decoded['email'], is_admin=decoded['is_admin'])
+        # Tokens which were decoded recently (by gRPC or HTTP API) are not decoded again
+        token_key = get_token_cache_key(request.token.value)
+        if (decoded := get_cached_token_payload(token_key)) is None:
+            try:
+                scheme, token = request.token.value.strip().split(' ')
+            except ValueError:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid JWT token')
+            else:
+                if scheme != 'Bearer':
+                    await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Invalid token scheme')
+                if token:
+                    token = token.encode()
+                    try:
+                        decoded = jwt.decode(token, JWT_SECRET_KEY, algorithms=settings.JWT_ALGORITHMS)
+                    except jwt.InvalidTokenError as exc:
+                        log.exception(exc, exc_info=exc)
+                        msg = f'Invalid authorization token, {exc}'
+                        await context.abort(grpc.StatusCode.INVALID_ARGUMENT, msg)
+                    else:
+                        cache_token_payload(token_key, decoded)
+        if decoded is not None:
+            user_id = decoded['id']
+            # Users deletion in this process updates the cache (see `UserRetrieveUpdateDestroyAPIView`)
+            if await check_user_tokens_revoked(self.engine, user_id):
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Token is revoked')
+            payload = Payload(user_id=user_id, email=decoded['email'], is_admin=decoded['is_admin'],
+                              exp=decoded.get('exp', 0))
 
         return AuthResponse(payload=payload)
 
@@ -52,12 +60,13 @@ class UserAuthService(UserAuthServicer):  # pragma: no cover because we have int
 class GRPCServer:
     """
     Creates gRPC server, bind it to port and start/stop it.
+    Database connections are taken from the pool of the application engine.
     """
 
-    def __init__(self):
+    def __init__(self, engine: AsyncEngine):
         grpc.aio.init_grpc_aio()
         self.server = grpc.aio.server()
-        add_UserAuthServicer_to_server(UserAuthService(), self.server)
+        add_UserAuthServicer_to_server(UserAuthService(engine=engine), self.server)
         # Add TLS creds for secure port
         with open('server.key', 'rb') as file:
             server_key = file.read()
@@ -0,0 +1,24 @@
+import time
+
+from customers.api.middleware import TOKEN_CACHE, get_token_cache_key, get_cached_token_payload, \
+    cache_token_payload, revoke_cached_tokens
+
+
+async def test_token_cache():
+    TOKEN_CACHE.clear()
+    payload = {'id': 1, 'is_admin': False, 'exp': time.time() + 3600}
+    token_key = get_token_cache_key('Bearer token')
+
+    # Payload of the expired token is not cached
+    cache_token_payload(token_key, {**payload, 'exp': time.time() - 1})
+    assert get_cached_token_payload(token_key) is None
+    assert token_key not in TOKEN_CACHE
+
+    # Tokens of the deleted user are dropped, tokens of other users are kept
+    other_token_key = get_token_cache_key('Bearer other_token')
+    cache_token_payload(token_key, payload)
+    cache_token_payload(other_token_key, {**payload, 'id': 2})
+    revoke_cached_tokens(user_id=payload['id'])
+    assert token_key not in TOKEN_CACHE
+    assert other_token_key in TOKEN_CACHE
+    TOKEN_CACHE.clear()
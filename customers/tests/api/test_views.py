@@ -1,8 +1,11 @@
 from http import HTTPStatus
 
 from aiohttp import ClientResponse
+from passlib.hash import sha256_crypt
 from sqlalchemy import select, func, desc, exists
 
+from customers import utils
+from customers.api.middleware import TOKEN_CACHE, get_token_cache_key
 from customers.db.factories import USER_TEST_PASSWORD, UserFactory
 from customers.db.models import User
 from customers.api import views, schema
@@ -148,6 +151,17 @@ async def test_login_user(authorized_api_client, db_session):
     assert not response_data['data']['user']['is_admin']
     assert response_data['data']['user']['email'] == user.email
 
+    # Check login of user with password hashed by deprecated scheme, the password is rehashed
+    legacy_user = UserFactory(password=sha256_crypt.hash(USER_TEST_PASSWORD))
+    await legacy_user.async_save(db_session=db_session)
+    request_data = {'email': legacy_user.email, 'password': USER_TEST_PASSWORD}
+    response = await api_client.post(url_for(views.LoginAPIView.URL_PATH), data=request_data)
+    assert response.status == HTTPStatus.OK
+    result = await db_session.execute(select(User.password).where(User.id == legacy_user.id))
+    new_password_hash = result.scalar()
+    assert new_password_hash != legacy_user.password
+    assert User.check_user_password(raw_password=USER_TEST_PASSWORD, hashed_password=new_password_hash)
+
 
 async def test_get_user_list(authorized_api_client, db_session):
     api_client, user = authorized_api_client
@@ -198,7 +212,7 @@ async def test_get_user_list(authorized_api_client, db_session):
     assert response_data['data'][0]['is_admin'] == user.is_admin
 
 
-async def test_retrieve_update_destroy_user(authorized_api_client, db_session):
+async def test_retrieve_update_destroy_user(authorized_api_client, db_session, monkeypatch):
     api_client, user = authorized_api_client
     other_user = UserFactory()
     await other_user.async_save(db_session=db_session)
@@ -220,6 +234,18 @@ async def test_retrieve_update_destroy_user(authorized_api_client, db_session):
     assert response_data['data']['last_name'] == user.last_name
     assert response_data['data']['is_admin'] == user.is_admin
 
+    # Token is decoded and checked once, then its payload is taken from the cache
+    token_key = get_token_cache_key(api_client._session.headers['Authorization'])
+    assert token_key in TOKEN_CACHE
+
+    async def check_user_tokens_revoked(*args, **kwargs):
+        raise AssertionError('Cached token is checked again')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(utils, 'check_user_tokens_revoked', check_user_tokens_revoked)
+        response = await api_client.get(url_for(views.UserRetrieveUpdateDestroyAPIView.URL_PATH, user_id=user.id))
+        assert response.status == HTTPStatus.OK
+
     # Get info about other_user
     response = await api_client.get(url_for(views.UserRetrieveUpdateDestroyAPIView.URL_PATH, user_id=other_user.id))
     # Response checks
@@ -318,6 +344,14 @@ async def test_retrieve_update_destroy_user(authorized_api_client, db_session):
     # DB check
     result = await db_session.execute(select(exists().where(User.id == user.id)))
     assert not result.scalar()
+    # Token of the deleted user is rejected right away, not served from the cache
+    assert token_key not in TOKEN_CACHE
+    response = await api_client.get(url_for(views.UserRetrieveUpdateDestroyAPIView.URL_PATH, user_id=other_user.id))
+    assert response.status == HTTPStatus.FORBIDDEN
+    assert response.content_type == 'application/json'
+    response_data = await response.json()
+    assert response_data['error']['code'] == 'forbidden'
+    assert response_data['error']['message'] == '403: Token is revoked'
 
     # Admin-user actions
     admin_user = UserFactory(is_admin=True)
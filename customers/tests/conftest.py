@@ -11,10 +11,11 @@ from sqlalchemy.orm import sessionmaker
 from yarl import URL
 
 from customers.api.app import create_app
+from customers.api.middleware import TOKEN_CACHE
 from customers.db.factories import UserFactory
 from customers.db.models import metadata
 from customers.settings import DB_URL
-from customers.utils import make_alembic_config, get_jwt_token_for_user
+from customers.utils import REVOKED_CACHE, make_alembic_config, get_jwt_token_for_user
 
 
 POSTGRES_DEFAULT_DB = "postgres"
@@ -131,6 +132,9 @@ async def authorized_api_client(db_session, aiohttp_client, aiomisc_unused_port:
     """
     Returns API test client with authorized user and user object.
     """
+    # Users ids are repeated in temporary databases, so cached tokens checks of previous tests are dropped
+    TOKEN_CACHE.clear()
+    REVOKED_CACHE.clear()
     app = create_app(pg_url=postgres_url)
     user = UserFactory()
     await user.async_save(db_session)
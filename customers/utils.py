@@ -1,4 +1,5 @@
 import logging
+import time
 from argparse import Namespace
 from collections.abc import AsyncIterable
 from datetime import datetime
@@ -7,17 +8,17 @@ import jwt
 from aiohttp.web_request import Request
 from aiohttp.web_urldispatcher import DynamicResource
 from alembic.config import Config
-from sqlalchemy import select, exists
 from sqlalchemy.engine import Row
-from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
 from sqlalchemy.sql import Select
 
 from customers import settings
-from customers.api.schema import UserSchema
-from customers.db.models import User, users_t
+from customers.db.models import User, USER_EXISTS_QUERY
 
 
 log = logging.getLogger(__name__)
+# Results of the tokens revocation checks: {user id: (expiration monotonic time, is revoked)}
+REVOKED_CACHE: dict[int, tuple[float, bool]] = {}
 
 
 def get_jwt_token_for_user(user: dict | Row | User) -> str:
@@ -25,7 +26,7 @@ def get_jwt_token_for_user(user: dict | Row | User) -> str:
     Return a jwt token for a given user_data.
     """
     if isinstance(user, (User, Row)):
-        user = UserSchema(only=('id', 'email', 'is_admin')).dump(user)
+        user = {'id': user.id, 'email': user.email, 'is_admin': user.is_admin}
     payload_data = {
         'id': user['id'],
         'email': user['email'],
@@ -36,34 +37,76 @@ def get_jwt_token_for_user(user: dict | Row | User) -> str:
     return token
 
 
+def cache_user_tokens_revoked(user_id: int, revoked: bool) -> None:
+    """
+    Stores the result of the user's tokens revocation check.
+    Not revoked tokens are the common case, so this result is kept longer.
+    """
+    if len(REVOKED_CACHE) >= settings.JWT_CACHE_MAX_SIZE:
+        for key in list(REVOKED_CACHE)[:settings.JWT_CACHE_MAX_SIZE // 10 or 1]:
+            del REVOKED_CACHE[key]
+    ttl = settings.JWT_REVOKED_CACHE_TTL if revoked else settings.JWT_NOT_REVOKED_CACHE_TTL
+    REVOKED_CACHE[user_id] = (time.monotonic() + ttl, revoked)
+
+
+async def check_user_tokens_revoked(engine: AsyncEngine, user_id: int) -> bool:
+    """
+    Checks if the user's tokens are revoked, i.e. the user doesn't exist.
+    Results are cached, so tokens of active users don't cost a database query on each check.
+    """
+    if (cached := REVOKED_CACHE.get(user_id)) is not None:
+        expires_at, revoked = cached
+        if expires_at > time.monotonic():
+            return revoked
+    async with engine.connect() as conn:
+        result = await conn.execute(USER_EXISTS_QUERY, {'user_id': user_id})
+    revoked = not result.scalar()
+    cache_user_tokens_revoked(user_id, revoked)
+    return revoked
+
+
 async def is_jwt_token_revoked(request: Request, decoded: dict) -> bool:
     """
     Checks if the user id from the decoded token exists.
     """
-    user_id = decoded['id']
-    query = select(exists().where(users_t.c.id == user_id))
-    async with request.app['engine'].connect() as conn:
-        result = await conn.execute(query)
-    return not result.scalar()
+    return await check_user_tokens_revoked(request.app['engine'], decoded['id'])
 
 
 class SelectQuery(AsyncIterable):
     """
     Used to send data from PostgreSQL to client immediately after receiving,
     without buffering all the data using server side cursor.
+    Rows are fetched from the cursor by batches of `batch_size` rows.
+    Query parameters are bound on execution, so the query itself could be prebuilt.
     """
 
-    __slots__ = ('query', 'transaction_ctx')
+    __slots__ = ('query', 'transaction_ctx', 'parameters', 'batch_size')
 
-    def __init__(self, query: Select, transaction_ctx: AsyncConnection):
+    def __init__(self, query: Select, transaction_ctx: AsyncConnection, parameters: dict | None = None,
+                 batch_size: int = 500):
         self.query = query
         self.transaction_ctx = transaction_ctx
+        self.parameters = parameters
+        self.batch_size = batch_size
 
     async def __aiter__(self):
         async with self.transaction_ctx as conn:
-            cursor = await conn.stream(self.query)
-            async for row in cursor:
-                yield row
+            cursor = await conn.stream(self.query, self.parameters)
+            async for partition in cursor.partitions(self.batch_size):
+                for row in partition:
+                    yield row
+
+
+class JSONSelectQuery(SelectQuery):
+    """
+    Same as SelectQuery, but for queries which return rows already serialized to JSON by PostgreSQL.
+    """
+
+    __slots__ = ()
+
+    async def __aiter__(self):
+        async for row in super().__aiter__():
+            yield row[0]
 
 
 def get_inner_exception(outer_exception: Exception) -> Exception: